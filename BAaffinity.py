@@ -0,0 +1,106 @@
+"""
+CPU placement of the BAserver worker processes.
+
+Every worker runs single threaded BornAgain simulations, so each one is pinned
+to one core of an allowed core set. Cores reserved for McStas can be excluded
+and with NUMA awareness consecutive workers are distributed round-robin over
+the NUMA nodes of the machine. Workers are always placed on the least used core
+of their node, so cores of closed connections are reused first.
+"""
+
+import glob
+import os
+
+NODE_PATH = "/sys/devices/system/node" # Linux sysfs location of the NUMA topology
+
+
+def parse_cpu_list(text):
+    """
+    Convert a Linux style cpu list like "0-3,8,10-11" into a sorted list of integers.
+    """
+    cpus = set()
+    for item in text.strip().split(','):
+        if not item:
+            continue
+        if '-' in item:
+            first, last = item.split('-')
+            cpus.update(range(int(first), int(last)+1))
+        else:
+            cpus.add(int(item))
+    return sorted(cpus)
+
+def format_cpu_list(cpus):
+    # inverse of parse_cpu_list, used for log messages
+    ranges = []
+    for ci in sorted(cpus):
+        if ranges and ci==ranges[-1][1]+1:
+            ranges[-1][1] = ci
+        else:
+            ranges.append([ci, ci])
+    return ','.join(f'{first}' if first==last else f'{first}-{last}' for first, last in ranges)
+
+def numa_nodes():
+    """
+    Return a dictionary node: [cpus] of the NUMA nodes, a single node 0 with
+    all cpus if the topology is not available.
+    """
+    nodes = {}
+    for path in glob.glob(os.path.join(NODE_PATH, 'node[0-9]*', 'cpulist')):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path, 'r') as fh:
+            cpus = parse_cpu_list(fh.read())
+        if cpus:
+            nodes[node] = cpus
+    if not nodes:
+        nodes[0] = sorted(os.sched_getaffinity(0))
+    return nodes
+
+class CpuPlacement:
+    """
+    Assigns cores to workers.
+
+    cpus: allowed cores, default all cores available to the server process
+    exclude: cores that are never used, e.g. reserved for McStas MPI ranks
+    numa: distribute consecutive workers round-robin over the NUMA nodes
+    """
+
+    def __init__(self, cpus=None, exclude=None, numa=False):
+        allowed = set(cpus) if cpus else set(os.sched_getaffinity(0))
+        allowed -= set(exclude or [])
+        if not allowed:
+            raise ValueError("No cpus left for BAserver workers")
+        if numa:
+            self.nodes = dict((node, [ci for ci in ncpus if ci in allowed])
+                              for node, ncpus in numa_nodes().items())
+            self.nodes = dict((node, ncpus) for node, ncpus in self.nodes.items() if ncpus)
+            # cores not listed in any node (e.g. hot-plugged) go to the first node
+            listed = set(ci for ncpus in self.nodes.values() for ci in ncpus)
+            if allowed-listed:
+                first = min(self.nodes) if self.nodes else 0
+                self.nodes[first] = sorted(set(self.nodes.get(first, []))|(allowed-listed))
+        else:
+            self.nodes = {0: sorted(allowed)}
+        self.usage = dict((ci, 0) for ci in allowed) # number of workers pinned to each core
+        self.next_node = 0
+
+    def assign(self):
+        """
+        Return (node, cpu) for a new worker.
+        """
+        nodes = sorted(self.nodes)
+        node = nodes[self.next_node%len(nodes)]
+        self.next_node += 1
+        cpu = min(self.nodes[node], key=lambda ci: (self.usage[ci], ci))
+        self.usage[cpu] += 1
+        return node, cpu
+
+    def release(self, cpu):
+        self.usage[cpu] -= 1
+
+    def free_cpus(self):
+        # allowed cores without a worker, used for background processes
+        return set(ci for ci, count in self.usage.items() if count==0)
+
+    def describe(self):
+        return '; '.join(f'node {node}: cpus {format_cpu_list(cpus)}'
+                         for node, cpus in sorted(self.nodes.items()))
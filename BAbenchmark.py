@@ -0,0 +1,150 @@
+"""
+Benchmark of the BornAgain event path used by BAserver.py.
+
+Runs the BARunnerProcess event processing directly (without McStas and without
+starting the worker process) for each model in the models folder and reports
+the time per event spent in each processing stage:
+sample construction, specular simulation, scattering simulation,
+response assembly and serialization.
+
+Results are written to a JSON file that can be compared to the result
+of another commit with the --compare option.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+from glob import glob
+from time import strftime
+
+import numpy as np
+
+from BAserver import BARunnerProcess, STAGES
+from BAhandshake import parse_oversample
+from BAloadclient import incident_events
+
+ODIMS = [102, 443] # number of events returned per incident event (splits)
+ANG_RANGES = [0.75, 1.5, 3.0] # degree scattering angle covered by detector
+WARMUP = 2 # number of events per case excluded from the statistics
+
+
+def get_models():
+    # all python modules in the models folder
+    return sorted(os.path.basename(fi)[:-3] for fi in glob(os.path.join('models', '*.py'))
+                  if not os.path.basename(fi).startswith('_'))
+
+def run_case(model, odim, ang_range, events, warmup=WARMUP, oversample=0):
+    """
+    Process all events with the given settings and return timing statistics
+    in seconds per event for each stage.
+    """
+    if len(events)<=warmup:
+        raise ValueError(f"Need more than {warmup} events, the first {warmup} are only used for warmup")
+    runner = BARunnerProcess(odim, ang_range, model, seed=0, # same sub-pixel offsets for every run
+                             oversample=oversample)
+    runner.setup()
+    timings = []
+    for i, e in enumerate(events):
+        runner.process_event(e)
+        if i>=warmup:
+            timings.append([runner.timing[stage] for stage in STAGES])
+    timings = np.array(timings)
+    total = timings.sum(axis=1)
+
+    result = {'model': model, 'odim': odim, 'ang_range': ang_range, 'oversample': oversample,
+              'det_dim': runner.det_dim, 'events': len(timings), 'stages': {}}
+    for stage, ti in zip(STAGES+('total',), list(timings.T)+[total]):
+        result['stages'][stage] = {
+            'mean': float(ti.mean()),
+            'median': float(np.median(ti)),
+            'p90': float(np.percentile(ti, 90)),
+            }
+    return result
+
+def get_metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import bornagain
+        ba_version = getattr(bornagain, '__version__', None)
+    except ImportError:
+        ba_version = None
+    return {
+        'commit': commit,
+        'date': strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'bornagain': ba_version,
+        }
+
+def print_result(result):
+    stages = result['stages']
+    print(f"{result['model']:30s} odim={result['odim']:4d} ang_range={result['ang_range']:5.2f} "
+          f"oversample={result['oversample']:2d}  "
+          +"  ".join(f"{stage}={1e3*stages[stage]['mean']:8.3f}ms" for stage in STAGES+('total',)))
+
+def case_key(result):
+    # settings that identify a benchmark case, files written before --oversample ran without it
+    return (result['model'], result['odim'], result['ang_range'], result.get('oversample', 0))
+
+def compare(old_file, new_file):
+    # print the ratio new/old of the mean time per stage for all cases found in both files
+    old = json.load(open(old_file, 'r'))
+    new = json.load(open(new_file, 'r'))
+    old_cases = dict((case_key(ri), ri) for ri in old['results'])
+    print(f"Comparing {new['metadata']['commit']} to {old['metadata']['commit']} (new/old time)")
+    for ri in new['results']:
+        key = case_key(ri)
+        if not key in old_cases:
+            continue
+        ratios = [ri['stages'][stage]['mean']/max(old_cases[key]['stages'][stage]['mean'], 1e-12)
+                  for stage in STAGES+('total',)]
+        print(f"{key[0]:30s} odim={key[1]:4d} ang_range={key[2]:5.2f} oversample={key[3]:2d}  "
+              +"  ".join(f"{stage}={ratio:6.3f}" for stage, ratio in zip(STAGES+('total',), ratios)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-m', '--model', action='append',
+                        help='model to benchmark, can be given multiple times (default all)')
+    parser.add_argument('-n', '--events', type=int, default=50,
+                        help=f'number of events per case, the first {WARMUP} are not timed')
+    parser.add_argument('--odim', type=int, nargs='+', default=ODIMS)
+    parser.add_argument('--ang-range', type=float, nargs='+', default=ANG_RANGES)
+    parser.add_argument('--oversample', type=parse_oversample, default=0, metavar='K',
+                        help='use oversampled scattering maps as BAserver --oversample')
+    parser.add_argument('-o', '--output', default=None,
+                        help='result file name (default stage_latency_{commit}.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running the benchmark')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.events<=WARMUP:
+        parser.error(f"--events has to be larger than the {WARMUP} warmup events")
+
+    metadata = get_metadata()
+    events = incident_events(args.events)
+    results = []
+    for model in (args.model or get_models()):
+        for odim in args.odim:
+            for ang_range in args.ang_range:
+                result = run_case(model, odim, ang_range, events, oversample=args.oversample)
+                print_result(result)
+                results.append(result)
+
+    output = args.output or f"stage_latency_{(metadata['commit'] or 'unknown')[:8]}.json"
+    with open(output, 'w') as fh:
+        json.dump({'metadata': metadata, 'results': results}, fh, indent=2)
+    print(f"Results written to {output}")
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Caches of scattering results for BAserver.py.
+
+The incident conditions (wavelength, alpha_i, phi_i) of a McStas run follow
+a fixed source distribution. The cache learns the empirical distribution of
+the conditions from the received events on a grid with the given tolerance
+and selects the densest grid cells for background precompute. Later events
+that fall into a cell with a stored result are served from it.
+
+Every stored result is used at most reuse times, afterwards the cell is
+calculated again, so frequent conditions don't end up with correlated
+outgoing directions from a single sub-pixel offset.
+
+MapCache keeps the oversampled scattering maps of one worker, from which
+the sub-pixel jitter of all events with similar conditions is drawn with
+sample_map at a continuous random offset.
+"""
+
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+MIN_EVENTS = 100 # number of observed events before precompute starts
+MAX_ENTRIES = 10000 # maximum number of stored results
+CANDIDATES = 64 # number of densest cells considered when selecting the next task
+LOOKAHEAD = 2000 # number of future events the stored results should cover
+MAP_CACHE_SIZE = 128 # number of oversampled maps kept per worker
+TOLERANCE = (0.01, 0.002, 0.002) # default grid of conditions (Å, deg, deg)
+
+
+def condition_key(tolerance, wavelength, alpha_i, phi):
+    # grid cell of the incident conditions
+    return tuple(int(ki) for ki in np.round(np.array([wavelength, alpha_i, phi])/tolerance))
+
+def map_padding(K):
+    # map cells added on each side of a map oversampled K times: half a pixel of shifts and one for interpolation
+    return K//2+1
+
+def sample_map(pmap, K, det_dim, shift_a, shift_p):
+    """
+    Detector image of det_dim² pixels taken from a map oversampled K times and padded by
+    map_padding(K) cells, with the detector shifted by (shift_a, shift_p) map cells (|shift|<=K/2).
+    The map is interpolated bilinearly at the shifted cell centers, so the offset is continuous,
+    and every pixel sums the KxK interpolated values it covers.
+    """
+    n = det_dim*K
+    ta = map_padding(K)+shift_a
+    tp = map_padding(K)+shift_p
+    ja, jp = int(np.floor(ta)), int(np.floor(tp))
+    fa, fp = ta-ja, tp-jp
+    fine = ((1.-fa)*(1.-fp)*pmap[ja:ja+n, jp:jp+n]+(1.-fa)*fp*pmap[ja:ja+n, jp+1:jp+1+n]
+            +fa*(1.-fp)*pmap[ja+1:ja+1+n, jp:jp+n]+fa*fp*pmap[ja+1:ja+1+n, jp+1:jp+1+n])
+    return fine.reshape(det_dim, K, det_dim, K).sum(axis=(1, 3))
+
+
+class CacheStats:
+    """
+    Hit and miss counts of a cache with an estimate of the saved calculation time.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.miss_time = 0. # total scattering time of events calculated live
+        self.saved = 0. # estimated scattering time saved by hits
+
+    def record(self, hit, scattering_time):
+        """
+        Count a served event together with the time spent in the scattering stage.
+        """
+        if hit:
+            self.hits += 1
+            if self.misses>0:
+                self.saved += max(self.miss_time/self.misses-scattering_time, 0.)
+        else:
+            self.misses += 1
+            self.miss_time += scattering_time
+
+    @property
+    def stats(self):
+        # (hits, misses, seconds saved) as registered in BAmetrics.Metrics.caches
+        return self.hits, self.misses, self.saved
+
+class ConditionCache(CacheStats):
+    """
+    tolerance: (dlambda [Å], dalpha [deg], dphi [deg]) grid size of the conditions
+    reuse: number of events served from one stored result
+    """
+
+    def __init__(self, tolerance=TOLERANCE, reuse=4, max_entries=MAX_ENTRIES):
+        self.tolerance = np.asarray(tolerance, dtype=float)
+        self.reuse = reuse
+        self.max_entries = max_entries
+        self.density = Counter() # observed events per cell
+        self.entries = {} # cell: list of [result, remaining uses]
+        self.pending = Counter() # cells with a precompute task in progress
+        self.observed = 0
+        self.stored = 0
+        super().__init__()
+
+    def key(self, wavelength, alpha_i, phi):
+        return condition_key(self.tolerance, wavelength, alpha_i, phi)
+
+    def center(self, key):
+        # (wavelength, alpha_i, phi) at the center of a grid cell
+        return tuple(float(ci) for ci in np.asarray(key)*self.tolerance)
+
+    def observe(self, key):
+        self.density[key] += 1
+        self.observed += 1
+
+    def get(self, key):
+        """
+        Return a stored result for the cell or None.
+        """
+        stock = self.entries.get(key)
+        if not stock:
+            return None
+        entry = stock[0]
+        entry[1] -= 1
+        if entry[1]<=0:
+            stock.pop(0)
+            self.stored -= 1
+            if not stock:
+                del self.entries[key]
+        return entry[0]
+
+    def put(self, key, result):
+        self.pending[key] -= 1
+        if self.pending[key]<=0:
+            del self.pending[key]
+        if self.stored>=self.max_entries:
+            return
+        self.entries.setdefault(key, []).append([result, self.reuse])
+        self.stored += 1
+
+    def next_task(self):
+        """
+        Cell that should be calculated next or None if there is nothing useful to do.
+        Cells are ranked by the difference between the expected number of events in the
+        next LOOKAHEAD events and the remaining uses of stored and pending results.
+        """
+        if self.observed<MIN_EVENTS or self.stored>=self.max_entries:
+            return None
+        best, best_deficit = None, 0.
+        for key, count in self.density.most_common(CANDIDATES):
+            if count<2:
+                # cells seen only once are no evidence for a dense region
+                break
+            stock = sum(ei[1] for ei in self.entries.get(key, []))+self.pending[key]*self.reuse
+            deficit = count/self.observed*LOOKAHEAD-stock
+            if deficit>best_deficit:
+                best, best_deficit = key, deficit
+        if best is None:
+            return None
+        self.pending[best] += 1
+        return best
+
+class MapCache(CacheStats):
+    """
+    Least recently used cache of scattering maps by grid cell of the incident conditions.
+    Hits and misses are counted with record by the user of the maps.
+    """
+
+    def __init__(self, tolerance=TOLERANCE, size=MAP_CACHE_SIZE):
+        self.tolerance = np.asarray(tolerance, dtype=float)
+        self.size = size
+        self.maps = OrderedDict()
+        super().__init__()
+
+    def key(self, wavelength, alpha_i, phi):
+        return condition_key(self.tolerance, wavelength, alpha_i, phi)
+
+    def get(self, key):
+        if key in self.maps:
+            self.maps.move_to_end(key)
+            return self.maps[key]
+        return None
+
+    def put(self, key, smap):
+        self.maps[key] = smap
+        if len(self.maps)>self.size:
+            self.maps.popitem(last=False)
+
+    def clear(self):
+        self.maps.clear()
@@ -0,0 +1,216 @@
+"""
+Server side detector for BAserver.py.
+
+Projects outgoing event directions from the sample onto a flat 2D detector
+perpendicular to the absolute z-axis, like the PSD_monitor in GISANS_test.instr,
+and accumulates intensity, squared weights and counts per pixel.
+The accumulated image can be written in the old style McStas format
+that is readable by mcstas_reader.McSim.
+"""
+
+import os
+from time import strftime, monotonic
+
+import numpy as np
+
+CHECK_INTERVAL = 1.0 # s - minimum time between convergence checks of a run
+
+
+class DetectorGrid:
+    """
+    Flat detector at distance [m] from the sample with total width/height [m]
+    and nx*ny pixels. Rotation is the absolute rotation matrix of the sample
+    component (McStas ROT_A_CURRENT_COMP) used to transform the velocities
+    from the sample frame to the absolute frame.
+    """
+
+    def __init__(self, distance, xwidth, yheight, nx, ny, rotation=None):
+        self.distance = distance
+        self.xwidth = xwidth
+        self.yheight = yheight
+        self.nx = nx
+        self.ny = ny
+        if rotation is None:
+            self.rotation = np.eye(3)
+        else:
+            self.rotation = np.asarray(rotation, dtype=float).reshape(3, 3)
+        self.I = np.zeros(ny*nx)
+        self.I2 = np.zeros(ny*nx)
+        self.N = np.zeros(ny*nx)
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Create from handshake options 'detector=distance,xwidth,yheight,nx,ny'
+        and optional 'rotation=r11,r12,...,r33'.
+        """
+        distance, xwidth, yheight, nx, ny = options['detector'].split(',')
+        rotation = None
+        if options.get('rotation', ''):
+            rotation = [float(ri) for ri in options['rotation'].split(',')]
+        return cls(float(distance), float(xwidth), float(yheight), int(nx), int(ny), rotation)
+
+    def pixels(self, vx, vy, vz):
+        """
+        Flat pixel index for velocities in the sample frame, -1 if the detector is missed.
+        """
+        # McStas rotations transform absolute to local coordinates, use the transposed matrix
+        v_abs = self.rotation.T @ np.array([np.ravel(vx), np.ravel(vy), np.ravel(vz)])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = self.distance*v_abs[0]/v_abs[2]
+            y = self.distance*v_abs[1]/v_abs[2]
+        ix = np.floor((x/self.xwidth+0.5)*self.nx)
+        iy = np.floor((y/self.yheight+0.5)*self.ny)
+        hit = (v_abs[2]>0)&(ix>=0)&(ix<self.nx)&(iy>=0)&(iy<self.ny)
+        idx = np.full(len(x), -1, dtype=int)
+        idx[hit] = (iy[hit]*self.nx+ix[hit]).astype(int)
+        return idx
+
+    def hits(self, p, vx, vy, vz):
+        """
+        Pixel indices and weights of all events that hit the detector.
+        """
+        p = np.ravel(p)
+        idx = self.pixels(vx, vy, vz)
+        hit = idx>=0
+        return idx[hit], p[hit]
+
+    def add_pixels(self, idx, p):
+        # accumulate weights p on flat pixel indices idx
+        size = self.nx*self.ny
+        self.I += np.bincount(idx, weights=p, minlength=size)
+        self.I2 += np.bincount(idx, weights=p**2, minlength=size)
+        self.N += np.bincount(idx, minlength=size)
+
+    def add(self, p, vx, vy, vz):
+        """
+        Accumulate events with weights p and velocities in the sample frame.
+        """
+        self.add_pixels(*self.hits(p, vx, vy, vz))
+
+    def roi_mask(self, roi=None):
+        """
+        Pixel mask of a region of interest (xmin, xmax, ymin, ymax) in detector coordinates [m].
+        """
+        if roi is None:
+            return np.ones(self.nx*self.ny, dtype=bool)
+        xmin, xmax, ymin, ymax = roi
+        x = (np.arange(self.nx)+0.5)/self.nx*self.xwidth-self.xwidth/2.
+        y = (np.arange(self.ny)+0.5)/self.ny*self.yheight-self.yheight/2.
+        X, Y = np.meshgrid(x, y)
+        return ((X>=xmin)&(X<=xmax)&(Y>=ymin)&(Y<=ymax)).flatten()
+
+    def relative_error(self, roi=None):
+        """
+        Intensity weighted mean of the pixel relative errors sqrt(sum p²)/sum p within the ROI.
+        """
+        mask = self.roi_mask(roi)
+        total = self.I[mask].sum()
+        if total<=0:
+            return np.inf
+        return np.sqrt(self.I2[mask]).sum()/total
+
+    def write(self, path, component='detector', ncount=0):
+        """
+        Write the accumulated image as old style McStas output (mccode.sim with
+        an array_2d data file) into the directory path.
+        """
+        os.makedirs(path, exist_ok=True)
+        fname = f'{component}.psd'
+        I = self.I.reshape(self.ny, self.nx)
+        I_err = np.sqrt(self.I2).reshape(self.ny, self.nx)
+        N = self.N.reshape(self.ny, self.nx)
+        xylimits = (f'{-50.*self.xwidth:g} {50.*self.xwidth:g} '
+                    f'{-50.*self.yheight:g} {50.*self.yheight:g}') # cm as PSD_monitor
+        info = [
+            ('Date', strftime('%a %b %d %H %M %Y')),
+            ('type', f'array_2d({self.nx}, {self.ny})'),
+            ('Source', 'BAserver.py'),
+            ('component', component),
+            ('position', f'0 0 {self.distance:g}'),
+            ('title', 'BAserver detector tally'),
+            ('Ncount', f'{ncount}'),
+            ('filename', fname),
+            ('statistics', 'X0=0; dX=0; Y0=0; dY=0;'),
+            ('signal', f'Min={I.min():g}; Max={I.max():g}; Mean={I.mean():g};'),
+            ('values', f'{I.sum():g} {np.sqrt(self.I2.sum()):g} {N.sum():g}'),
+            ('xvar', 'X'),
+            ('yvar', 'Y'),
+            ('xlabel', 'X position [cm]'),
+            ('ylabel', 'Y position [cm]'),
+            ('zvar', 'I'),
+            ('zlabel', 'Signal per bin'),
+            ('xylimits', xylimits),
+            ('variables', 'I I_err N'),
+            ]
+        with open(os.path.join(path, 'mccode.sim'), 'w') as fh:
+            fh.write('McStas simulation description file for BAserver.\n')
+            fh.write(f'Date:    {strftime("%a %b %d %H %M %Y")}\n')
+            fh.write('Program: BAserver.py\n\n')
+            fh.write('begin data\n')
+            for key, value in info:
+                fh.write(f'  {key}: {value}\n')
+            fh.write('end data\n')
+        with open(os.path.join(path, fname), 'w') as fh:
+            for key, value in info:
+                fh.write(f'# {key}: {value}\n')
+            fh.write('# Data [detector/I] I:\n')
+            np.savetxt(fh, I)
+            fh.write('# Errors [detector/I_err] I_err:\n')
+            np.savetxt(fh, I_err)
+            fh.write('# Events [detector/N] N:\n')
+            np.savetxt(fh, N)
+
+class RunStatistics:
+    """
+    Detector statistics of all connections (e.g. MPI processes) of one McStas run.
+
+    target: relative error at which the run is considered converged (0 = never)
+    roi: region of interest (xmin, xmax, ymin, ymax) [m] used for the error
+    stop: request cooperating clients to end the run once converged
+    """
+
+    def __init__(self, detector, target=0., roi=None, stop=False):
+        self.detector = detector
+        self.target = target
+        self.roi = roi
+        self.stop = stop
+        self.active = 0 # number of connected clients
+        self.events = 0 # number of incident events
+        self.ncount = 0 # McStas ncount of all clients, as sent in the handshakes
+        self.converged = False
+        self.error = np.inf
+        self.last_check = 0.
+
+    @classmethod
+    def from_options(cls, options):
+        roi = None
+        if options.get('roi', ''):
+            roi = [float(ri) for ri in options['roi'].split(',')]
+        return cls(DetectorGrid.from_options(options), target=float(options.get('target', 0.)),
+                   roi=roi, stop=options.get('stop', '0') not in ('0', ''))
+
+    def add(self, idx, p):
+        self.events += 1
+        self.detector.add_pixels(idx, p)
+
+    def check(self):
+        """
+        Update the convergence state at most every CHECK_INTERVAL seconds.
+        """
+        now = monotonic()
+        if self.target>0 and not self.converged and now-self.last_check>=CHECK_INTERVAL:
+            self.last_check = now
+            self.error = self.detector.relative_error(self.roi)
+            self.converged = self.error<=self.target
+        return self.converged
+
+    def status(self, target=None, roi=None):
+        """
+        One line status report, target and roi can differ from the run settings.
+        """
+        target = self.target if target is None else target
+        error = self.detector.relative_error(self.roi if roi is None else roi)
+        converged = int(target>0 and error<=target)
+        return (f"events={self.events};active={self.active};error={error:.6g};"
+                f"target={target:g};converged={converged}")
@@ -0,0 +1,48 @@
+"""
+Parsing of the client handshake of BAserver.py.
+
+Kept separate from the server so that clients and tests can use it
+without importing BornAgain.
+"""
+
+MIN_OVERSAMPLE = 4 # smallest oversampling factor of the scattering maps, see parse_oversample
+
+
+def parse_handshake(request, defaults=None):
+    """
+    Extract simulation parameters from the client handshake
+    'INIT;McStas;odim;ang_range;model' that can be followed by optional
+    'key=value' items overwriting the server defaults.
+    """
+    _, _, odim, ang_range, ba_model, *extra = request.strip().split(';')
+    options = dict(defaults or {})
+    for item in extra:
+        if '=' in item:
+            key, value = item.split('=', 1)
+            options[key.strip()] = value.strip()
+    return int(odim), float(ang_range), ba_model.strip(), options
+
+def model_params(options):
+    """
+    Model parameters from 'param.<name>=<value>' handshake options,
+    numbers are converted to float.
+    """
+    params = {}
+    for key, value in options.items():
+        if key.startswith('param.'):
+            try:
+                params[key[6:]] = float(value)
+            except ValueError:
+                params[key[6:]] = value
+    return params
+
+def parse_oversample(text):
+    """
+    Oversampling factor K of the scattering maps, 0 (off) or at least MIN_OVERSAMPLE.
+    Coarser maps under-resolve features narrower than a pixel (e.g. Laue peaks),
+    which biases the intensity even with interpolated offsets.
+    """
+    K = int(text)
+    if K!=0 and K<MIN_OVERSAMPLE:
+        raise ValueError(f"oversample has to be 0 or at least {MIN_OVERSAMPLE}, not {K}")
+    return K
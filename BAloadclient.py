@@ -0,0 +1,331 @@
+"""
+Load generator for BAserver.py that emulates the BAclient McStas component.
+
+Opens a number of concurrent connections to the server using the same protocol
+as BAclient.comp (INIT handshake, one line per incident event and a fixed length
+reply of splits events) and replays synthetic or recorded incident events.
+Reports throughput, latency percentiles and error counts.
+
+Connections recorded with "BAserver.py --record DIR" can be played back
+with --replay, the SHA-256 digest of all replies allows to compare the results
+of seeded runs bit for bit.
+
+Does not require McStas, MPI or BornAgain.
+"""
+
+import argparse
+import hashlib
+import socket
+import threading
+from time import perf_counter
+
+import numpy as np
+
+PORT = 15555
+V2L = 3956.034012 # m/s·Å
+EVENT_LENGTH = 4*16+3+1 # fixed length of each returned event line
+EVENT_TYPE = np.dtype([
+    ('p', np.float64),
+    ('vx', np.float64),
+    ('vy', np.float64),
+    ('vz', np.float64),
+])
+
+
+def incident_events(n, wavelength=6.0, resolution=0.1, alpha_i=0.3, divergence=0.03, seed=0):
+    """
+    Generate synthetic incident events similar to the GISANS_test instrument with
+    uniform wavelength spread and angular divergence (degrees) around alpha_i.
+    """
+    rng = np.random.default_rng(seed)
+    lam = wavelength*(1.+resolution*(rng.random(n)-0.5))
+    alpha = np.radians(alpha_i+divergence*(2.*rng.random(n)-1.))
+    phi = np.radians(divergence*(2.*rng.random(n)-1.))
+    v = V2L/lam
+
+    events = np.zeros(n, dtype=EVENT_TYPE)
+    events['p'] = 1.0
+    events['vy'] = v/np.sqrt(1.+np.tan(alpha)**2+np.tan(phi)**2)
+    events['vz'] = events['vy']*np.tan(alpha)
+    events['vx'] = events['vy']*np.tan(phi)
+    return events.view(np.rec.recarray)
+
+def load_events(fname):
+    """
+    Read recorded events from a text file with either the columns p, vx, vy, vz
+    or a McStas event file with p, x, y, z, vx, vy, vz, t, sx, sy, sz.
+    """
+    data = np.atleast_2d(np.loadtxt(fname))
+    events = np.zeros(len(data), dtype=EVENT_TYPE)
+    if data.shape[1]==4:
+        cols = [0, 1, 2, 3]
+    elif data.shape[1]==11:
+        cols = [0, 4, 5, 6]
+    else:
+        raise ValueError(f"Unknown event file format with {data.shape[1]} columns")
+    for name, col in zip(EVENT_TYPE.names, cols):
+        events[name] = data[:, col]
+    return events.view(np.rec.recarray)
+
+def recv_exact(client, length):
+    # read exactly length bytes from the socket, returns less only if the connection was closed
+    chunks = []
+    remaining = length
+    while remaining>0:
+        chunk = client.recv(min(remaining, 65536))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def load_recording(fname):
+    """
+    Read a connection recorded by BAserver.py --record, returns the handshake
+    and the list of incident event requests.
+    """
+    with open(fname, 'r') as fh:
+        lines = fh.readlines()
+    if not lines or not lines[0].startswith('INIT;McStas'):
+        raise ValueError(f"{fname} is not a recorded BAserver connection")
+    return lines[0], lines[1:]
+
+def connect(address, port, splits, ang_range, model, options='', handshake=None):
+    """
+    Open a connection and perform the BAclient handshake.
+    An address "unix:/path" connects to a local unix domain socket.
+    A recorded handshake line is sent unchanged instead of the generated one.
+    """
+    if address.startswith('unix:'):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address[5:])
+    else:
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect((address, port))
+    if handshake is None:
+        handshake = f"INIT;McStas;{splits:d};{ang_range:.5f};{model}"+(f";{options}" if options else "")+"\n"
+    client.sendall(handshake.encode('ascii'))
+    ack = recv_exact(client, 4)
+    if ack!=b'ACK\n':
+        client.close()
+        raise ConnectionError(f"Handshake failed, server replied {ack!r}")
+    return client
+
+def query_status(address, port, run, target=None, roi=''):
+    """
+    Query the convergence state of a run with a server side detector.
+    Returns a dictionary of the reported values.
+    """
+    if address.startswith('unix:'):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address[5:])
+    else:
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect((address, port))
+    target = '' if target is None else f'{target:g}'
+    client.sendall(f"STATUS;{run};{target};{roi}\n".encode('ascii'))
+    reply = b''
+    while not reply.endswith(b'\n'):
+        chunk = client.recv(1024)
+        if not chunk:
+            break
+        reply += chunk
+    client.close()
+    name, *items = reply.decode('ascii').strip().split(';')
+    if items==['unknown']:
+        raise KeyError(f"Server has no run '{name}'")
+    return dict(item.split('=', 1) for item in items)
+
+class ConnectionRunner(threading.Thread):
+    """
+    Sends a sequence of incident events over one connection and collects
+    the latency of every request together with the number of errors.
+    Events can also be recorded request lines, sent after the recorded handshake.
+    """
+
+    def __init__(self, events, address='127.0.0.1', port=PORT, splits=443, ang_range=1.5,
+                 model="silica_100nm_air", options='', handshake=None):
+        self.events = events
+        self.address = address
+        self.port = port
+        self.splits = splits
+        self.ang_range = ang_range
+        self.model = model
+        self.options = options
+        self.handshake = handshake
+        if handshake is not None:
+            self.splits = int(handshake.split(';')[2])
+        items = dict(item.split('=', 1) for item in (handshake or options).strip().split(';') if '=' in item)
+        # the server only uses tally and stop together with a detector geometry
+        detector = bool(items.get('detector', ''))
+        if items.get('tally', '') and detector:
+            # server side detector tally only returns specular and transmitted events
+            self.nreply = 2
+        else:
+            self.nreply = self.splits
+        # runs with stop=1 end every reply with a STOP/RUN status line
+        self.nstatus = 1 if detector and items.get('stop', '0') not in ('0', '') else 0
+        self.stops = 0
+        self.digest = hashlib.sha256()
+        self.latencies = []
+        self.errors = 0
+        self.returned = 0
+        super().__init__(daemon=True)
+
+    def run(self):
+        try:
+            client = connect(self.address, self.port, self.splits, self.ang_range, self.model,
+                             self.options, self.handshake)
+        except (OSError, ConnectionError):
+            self.errors += len(self.events)
+            return
+        reply_length = (self.nreply+self.nstatus)*EVENT_LENGTH
+        try:
+            for e in self.events:
+                start = perf_counter()
+                if isinstance(e, str):
+                    request = e
+                else:
+                    # BAclient sends the weight of all splits of the event
+                    request = "%e;%e;%e;%e\n"%(self.splits*e.p, e.vx, e.vy, e.vz)
+                client.sendall(request.encode('ascii'))
+                reply = recv_exact(client, reply_length)
+                self.latencies.append(perf_counter()-start)
+                if len(reply)!=reply_length:
+                    # connection closed by server
+                    self.errors += 1
+                    break
+                self.digest.update(reply)
+                self.check_reply(reply)
+        except OSError:
+            self.errors += 1
+        finally:
+            client.close()
+
+    def check_reply(self, reply):
+        # parse returned events the same way as BAclient, count lines that can't be interpreted
+        for i in range(self.nreply):
+            line = reply[i*EVENT_LENGTH:(i+1)*EVENT_LENGTH].decode('ascii', errors='replace')
+            try:
+                if len([float(vi) for vi in line.split(';')])!=4:
+                    raise ValueError
+            except ValueError:
+                self.errors += 1
+                return
+        if self.nstatus>0:
+            status = reply[self.nreply*EVENT_LENGTH:].decode('ascii', errors='replace').strip()
+            if status not in ('STOP', 'RUN'):
+                self.errors += 1
+                return
+            self.stops += status=='STOP'
+        self.returned += self.nreply
+
+def run_load(events, connections=8, seed=None, options='', **kwargs):
+    """
+    Distribute events over concurrent connections and return a dictionary
+    with throughput, latency percentiles and error counts.
+    With a seed every connection requests its own reproducible random stream,
+    options are additional handshake items like "param.radius=50".
+    """
+    runners = []
+    for i in range(connections):
+        conn_options = [options] if options else []
+        if seed is not None:
+            conn_options.append(f'seed={seed};stream={i}')
+        runners.append(ConnectionRunner(events[i::connections], options=';'.join(conn_options), **kwargs))
+    return run_runners(runners, len(events))
+
+def replay(fnames, **options):
+    """
+    Play back recorded connections concurrently, returns the same statistics
+    as run_load together with the reply digest of each connection.
+    """
+    runners = []
+    for fname in fnames:
+        handshake, requests = load_recording(fname)
+        runners.append(ConnectionRunner(requests, handshake=handshake, **options))
+    result = run_runners(runners, sum(len(runner.events) for runner in runners))
+    result['digests'] = dict((fname, runner.digest.hexdigest()) for fname, runner in zip(fnames, runners))
+    return result
+
+def run_runners(runners, events):
+    # run all connections concurrently and collect their statistics
+    connections = len(runners)
+    start = perf_counter()
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    duration = perf_counter()-start
+
+    latencies = np.array(sum((runner.latencies for runner in runners), []))
+    processed = len(latencies)
+    if processed==0:
+        latencies = np.array([np.nan])
+    return {
+        'connections': connections,
+        'events': events,
+        'duration': duration,
+        'throughput': processed/duration, # incident events/s
+        'returned_per_s': sum(runner.returned for runner in runners)/duration,
+        'latency_p50': float(np.percentile(latencies, 50)),
+        'latency_p99': float(np.percentile(latencies, 99)),
+        'errors': sum(runner.errors for runner in runners),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('address', nargs='?', default='127.0.0.1',
+                        help='server IP address or unix:/path for a unix domain socket')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('-c', '--connections', type=int, nargs='+', default=[8],
+                        help='number of concurrent connections, multiple values run a scaling test')
+    parser.add_argument('-n', '--events', type=int, default=1000, help='number of synthetic events')
+    parser.add_argument('-e', '--event-file', help='replay events from this file instead')
+    parser.add_argument('-o', '--options', default='',
+                        help='additional handshake options separated by ";", e.g. "param.radius=50"')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='run seed sent in the handshake for reproducible server results')
+    parser.add_argument('--replay', nargs='+', metavar='FILE',
+                        help='play back connections recorded with BAserver.py --record')
+    parser.add_argument('-m', '--model', default="silica_100nm_air")
+    parser.add_argument('-s', '--splits', type=int, default=443)
+    parser.add_argument('-a', '--ang-range', type=float, default=1.5)
+    parser.add_argument('--status', metavar='RUN',
+                        help='only report the convergence state of a run with server side detector')
+    parser.add_argument('--target', type=float, help='relative error target for --status')
+    parser.add_argument('--roi', default='', help='region of interest xmin,xmax,ymin,ymax for --status')
+    args = parser.parse_args()
+
+    if args.status:
+        status = query_status(args.address, args.port, args.status, args.target, args.roi)
+        print(f"{args.status}: "+"  ".join(f"{key}={value}" for key, value in status.items()))
+        return
+
+    if args.replay:
+        res = replay(args.replay, address=args.address, port=args.port)
+        print(f"{res['connections']:4d} connections: {res['throughput']:10.2f} events/s "
+              f"({res['returned_per_s']:12.1f} returned/s)  "
+              f"p50={1e3*res['latency_p50']:9.3f}ms  p99={1e3*res['latency_p99']:9.3f}ms  "
+              f"errors={res['errors']}")
+        for fname, digest in res['digests'].items():
+            print(f"  {fname}: sha256 {digest}")
+        return
+
+    if args.event_file:
+        events = load_events(args.event_file)
+    else:
+        events = incident_events(args.events)
+
+    for connections in args.connections:
+        res = run_load(events, connections, address=args.address, port=args.port,
+                       splits=args.splits, ang_range=args.ang_range, model=args.model,
+                       seed=args.seed, options=args.options)
+        print(f"{res['connections']:4d} connections: {res['throughput']:10.2f} events/s "
+              f"({res['returned_per_s']:12.1f} returned/s)  "
+              f"p50={1e3*res['latency_p50']:9.3f}ms  p99={1e3*res['latency_p99']:9.3f}ms  "
+              f"errors={res['errors']}")
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Collection of live metrics of BAserver.py and a small HTTP endpoint
+that serves them in the Prometheus text exposition format.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from time import monotonic
+
+PREFIX = "baserver_"
+# upper bounds in seconds of the stage timing histogram buckets
+TIME_BUCKETS = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+RATE_WINDOW = 10.0 # s - time window used to calculate event rates
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket limits.
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        for i, limit in enumerate(self.buckets):
+            if value<=limit:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def expose(self, name, labels=''):
+        lines = []
+        for limit, count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{{labels}le="{limit:g}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels.rstrip(",")}}} {self.sum:.9g}')
+        lines.append(f'{name}_count{{{labels.rstrip(",")}}} {self.count}')
+        return lines
+
+class RateCounter:
+    """
+    Counter that also reports the rate of increase over the last RATE_WINDOW seconds.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.history = deque()
+
+    def add(self, value=1):
+        now = monotonic()
+        self.total += value
+        self.history.append((now, value))
+        while self.history and self.history[0][0]<now-RATE_WINDOW:
+            self.history.popleft()
+
+    @property
+    def rate(self):
+        now = monotonic()
+        while self.history and self.history[0][0]<now-RATE_WINDOW:
+            self.history.popleft()
+        return sum(vi for _, vi in self.history)/RATE_WINDOW
+
+class ConnectionMetrics:
+    """
+    Counters of a single client connection and its worker process.
+    """
+
+    def __init__(self, conn_id, model, worker):
+        self.conn_id = conn_id
+        self.model = model
+        self.worker = worker
+        self.received = RateCounter()
+        self.sent = RateCounter()
+
+    @property
+    def labels(self):
+        return f'connection="{self.conn_id}",model="{self.model}"'
+
+    @property
+    def queue_depth(self):
+        try:
+            return self.worker.input.qsize()
+        except NotImplementedError:
+            # not available on all platforms
+            return 0
+
+class Metrics:
+    """
+    Global server metrics, updated by the connection handlers.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.connections_total = 0
+        self.connections = {}
+        self.received = RateCounter()
+        self.sent = RateCounter()
+        self.stage_time = dict((stage, Histogram()) for stage in stages)
+        # name: (hits, misses, seconds saved) of result caches, registered by the cache implementations
+        self.caches = {}
+
+    def open_connection(self, model, worker):
+        self.connections_total += 1
+        conn = ConnectionMetrics(self.connections_total, model, worker)
+        self.connections[conn.conn_id] = conn
+        return conn
+
+    def close_connection(self, conn):
+        del self.connections[conn.conn_id]
+
+    def add_event(self, conn, returned, timing):
+        """
+        Record one processed incident event with the number of returned events
+        and the time spent in each stage.
+        """
+        self.received.add()
+        self.sent.add(returned)
+        conn.received.add()
+        conn.sent.add(returned)
+        for stage, ti in timing.items():
+            self.stage_time[stage].observe(ti)
+
+    def expose(self):
+        """
+        Return all metrics in Prometheus text exposition format.
+        """
+        lines = [
+            f'# HELP {PREFIX}connections_total Number of client connections since server start.',
+            f'# TYPE {PREFIX}connections_total counter',
+            f'{PREFIX}connections_total {self.connections_total}',
+            f'# HELP {PREFIX}active_workers Number of running BornAgain worker processes.',
+            f'# TYPE {PREFIX}active_workers gauge',
+            f'{PREFIX}active_workers {len(self.connections)}',
+            f'# HELP {PREFIX}events_received_total Incident events received from clients.',
+            f'# TYPE {PREFIX}events_received_total counter',
+            f'{PREFIX}events_received_total {self.received.total}',
+            f'# HELP {PREFIX}events_sent_total Outgoing events sent back to clients.',
+            f'# TYPE {PREFIX}events_sent_total counter',
+            f'{PREFIX}events_sent_total {self.sent.total}',
+            f'# HELP {PREFIX}events_received_per_second Incident event rate over the last {RATE_WINDOW:g}s.',
+            f'# TYPE {PREFIX}events_received_per_second gauge',
+            f'{PREFIX}events_received_per_second {self.received.rate:.6g}',
+            ]
+        lines += [
+            f'# HELP {PREFIX}connection_events_received_total Incident events received per connection.',
+            f'# TYPE {PREFIX}connection_events_received_total counter',
+            ]
+        lines += [f'{PREFIX}connection_events_received_total{{{ci.labels}}} {ci.received.total}'
+                  for ci in self.connections.values()]
+        lines += [
+            f'# HELP {PREFIX}connection_events_received_per_second Incident event rate per connection.',
+            f'# TYPE {PREFIX}connection_events_received_per_second gauge',
+            ]
+        lines += [f'{PREFIX}connection_events_received_per_second{{{ci.labels}}} {ci.received.rate:.6g}'
+                  for ci in self.connections.values()]
+        lines += [
+            f'# HELP {PREFIX}worker_queue_depth Events waiting in the worker input queue.',
+            f'# TYPE {PREFIX}worker_queue_depth gauge',
+            ]
+        lines += [f'{PREFIX}worker_queue_depth{{{ci.labels}}} {ci.queue_depth}'
+                  for ci in self.connections.values()]
+        lines += [
+            f'# HELP {PREFIX}stage_seconds Time per incident event spent in each processing stage.',
+            f'# TYPE {PREFIX}stage_seconds histogram',
+            ]
+        for stage in self.stages:
+            lines += self.stage_time[stage].expose(f'{PREFIX}stage_seconds', f'stage="{stage}",')
+        if self.caches:
+            lines += [
+                f'# HELP {PREFIX}cache_hits_total Requests served from a result cache.',
+                f'# TYPE {PREFIX}cache_hits_total counter',
+                ]
+            lines += [f'{PREFIX}cache_hits_total{{cache="{name}"}} {hits}'
+                      for name, (hits, _, _) in self.caches.items()]
+            lines += [
+                f'# HELP {PREFIX}cache_misses_total Requests not found in a result cache.',
+                f'# TYPE {PREFIX}cache_misses_total counter',
+                ]
+            lines += [f'{PREFIX}cache_misses_total{{cache="{name}"}} {misses}'
+                      for name, (_, misses, _) in self.caches.items()]
+            lines += [
+                f'# HELP {PREFIX}cache_hit_ratio Fraction of requests served from a result cache.',
+                f'# TYPE {PREFIX}cache_hit_ratio gauge',
+                ]
+            lines += [f'{PREFIX}cache_hit_ratio{{cache="{name}"}} {hits/max(hits+misses, 1):.6g}'
+                      for name, (hits, misses, _) in self.caches.items()]
+            lines += [
+                f'# HELP {PREFIX}cache_seconds_saved_total Estimated calculation time saved by a result cache.',
+                f'# TYPE {PREFIX}cache_seconds_saved_total counter',
+                ]
+            lines += [f'{PREFIX}cache_seconds_saved_total{{cache="{name}"}} {saved:.6g}'
+                      for name, (_, _, saved) in self.caches.items()]
+        return "\n".join(lines)+"\n"
+
+async def serve_metrics(metrics, interface='127.0.0.1', port=9155):
+    """
+    Minimal HTTP server that answers every request with the current metrics.
+    """
+    async def handle(reader, writer):
+        try:
+            # read request header, content is ignored
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            body = metrics.expose().encode('utf-8')
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         +f'Content-Length: {len(body)}\r\n\r\n'.encode('ascii')+body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    logging.info(f"Serving metrics on http://{interface}:{port}/metrics")
+    server = await asyncio.start_server(handle, interface, port)
+    async with server:
+        await server.serve_forever()
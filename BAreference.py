@@ -14,6 +14,8 @@ import bornagain as ba
 from bornagain import deg, angstrom, nm
 from bornagain.numpyutil import Arrayf64Converter
 
+from models import create_sample, model_hash
+
 MFILE = "models."
 
 @dataclass
@@ -42,10 +44,12 @@ class BARunner:
         self.ba_model = ba_model
 
     def simulate(self):
+        start = time()
         print("Generate model")
         print(f"  instrument configuration: {self.instrument_config}")
         sim_module = import_module(MFILE+self.ba_model)
-        self.sample = sim_module.get_sample(0.)
+        self.model_hash = model_hash(sim_module)
+        self.sample = create_sample(sim_module)
 
         self.sim = self.get_simulation()
         self.add_beam_resolution()
@@ -58,6 +62,7 @@ class BARunner:
         self.I = Arrayf64Converter.asNpArray(self.res.dataArray())
         self.add_transmitted()
         self.apply_sample_size()
+        self.duration = time()-start
 
     def get_simulation(self):
         beam = ba.Beam(self.instrument_config.I0,
@@ -117,8 +122,23 @@ class BARunner:
 
 
     def store_result(self, fname):
+        """
+        Save the detector image, files ending in .h5 are a ResultStore
+        (see result_store.py) that collects many results with their metadata.
+        """
         print(f"Saving to file {fname}")
-        np.savez(fname, self.I)
+        if fname.endswith('.h5'):
+            from result_store import ResultStore
+            # the detector is centered on the direct beam (alpha_f=-alpha_i) and spans DET_SIZE at
+            # the collimation distance, stored in cm like the McStas PSD_monitor in GISANS_test.instr
+            half = 50.*self.DET_SIZE
+            with ResultStore(fname) as store:
+                key = store.add(self.I, self.ba_model, self.instrument_config, source='bornagain',
+                                model_hash=self.model_hash, duration=self.duration,
+                                extent=(-half, half, -half, half), extent_unit='cm')
+            print(f"  stored as result {key}")
+        else:
+            np.savez(fname, self.I)
 
 if __name__ == "__main__":
     import sys, os
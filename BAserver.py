@@ -7,21 +7,51 @@ Developed for BornAgain 23.0.
 """
 
 import asyncio
+import cProfile
+import importlib
+import itertools
 import logging
+import os
 import socket
+import stat
 import multiprocessing
 import numpy as np
 
+from time import perf_counter, monotonic
 from importlib import import_module
 import bornagain as ba
 from bornagain import deg, angstrom, nm
 from bornagain.numpyutil import Arrayf64Converter
 
+from BAmetrics import Metrics, serve_metrics
+from BAdetector import DetectorGrid, RunStatistics
+from BAaffinity import CpuPlacement, parse_cpu_list, format_cpu_list
+from BAcache import ConditionCache, MapCache, map_padding, sample_map
+from BAhandshake import parse_handshake, model_params, parse_oversample
+from fastborn import get_engine, bin_centers
+from roulette import russian_roulette
+from models import create_sample, get_symmetry, get_parameters, model_hash, fold_phi
+
 MFILE = "models."
 
 V2L = 3956.034012 # m/s·Å
 ANGLE_RANGE=1.5 # degree scattering angle covered by detector
 DEBUG = False
+PROFILE_DIR = "profiles" # directory for worker profile dumps
+TALLY_DIR = "ba_tally" # directory for server side detector images
+RELOAD_INTERVAL = 2.0 # s - minimum time between checks of the model file for changes
+PRECOMPUTE_NICE = 19 # niceness of the background precompute processes
+PRECOMPUTE_QUEUE = 2 # number of tasks queued per precompute process
+EVENT_LENGTH = 4*16+3+1 # fixed length of each returned event line, see serialize
+# stages of the event processing that are timed individually
+STAGES = ('sample', 'specular', 'scattering', 'assemble', 'serialize')
+
+def incident_conditions(vx, vy, vz):
+    # wavelength [Å], alpha_i [deg] and phi_i [deg] of an incident event in the sample frame
+    alpha_i = np.arctan2(vz, vy) * 180. / np.pi
+    phi_i = np.arctan2(vx, vy) * 180. / np.pi
+    wavelength = V2L / np.sqrt(vx ** 2 + vy ** 2 + vz ** 2)
+    return wavelength, alpha_i, phi_i
 
 class BARunnerProcess(multiprocessing.Process):
     """
@@ -31,94 +61,358 @@ class BARunnerProcess(multiprocessing.Process):
     """
 
 
-    def __init__(self, odim=102, ang_range=ANGLE_RANGE, ba_model="silica_100nm_air"):
+    def __init__(self, odim=102, ang_range=ANGLE_RANGE, ba_model="silica_100nm_air",
+                 profile=0, engine='bornagain', roulette=0., detector=None, tally=False,
+                 cpu=None, seed=None, stream=0, params=None, oversample=0, name='worker'):
         self.log = multiprocessing.Queue() # sends log-messages back to the main process
         self.input = multiprocessing.Queue()
         self.output = multiprocessing.Queue()
         self.ang_range=ang_range
         self.ba_model=ba_model
         self.odim = odim # length of event stream to return per input
-        super().__init__()
+        self.profile = profile # number of events to run with cProfile
+        self.engine_name = engine # 'bornagain' or 'fastborn' for models that support it
+        self.roulette = roulette # fraction of incident weight below which events are pruned
+        self.detector = detector # DetectorGrid to project scattered events for run statistics
+        self.tally = tally # only return specular and transmitted events, scattered go to detector
+        self.cpu = cpu # core the process is pinned to, None leaves placement to the OS
+        self.seed = seed # run seed for reproducible results, None uses fresh entropy
+        self.stream = stream # independent random stream of this connection within the run
+        self.params = dict(params or {}) # model parameters passed to get_sample
+        self.oversample = oversample # >1 draws the sub-pixel jitter from maps oversampled by this factor
+        super().__init__(name=name)
 
     def run(self):
-        self.log.put_nowait((logging.INFO,
-                            f'Start long running computation on process {multiprocessing.current_process()}'))
-        # detector dimension to create at least as many events as requested
-        self.det_dim = int(np.sqrt(self.odim-3)+1)
-        self.log.put_nowait((logging.INFO,
-                            f'  simulation detector size {self.det_dim}x{self.det_dim}'))
-        sim_module = import_module(MFILE+self.ba_model)
-        self.log.put_nowait((logging.INFO,
-                             f'  loaded model {MFILE+self.ba_model}'))
+        if self.cpu is not None:
+            os.sched_setaffinity(0, {self.cpu})
+            self.log.put_nowait((logging.INFO,
+                                 f'  {self.name} pinned to cpus {format_cpu_list(os.sched_getaffinity(0))}'))
+        self.setup()
+        if self.profile>0:
+            profiler = cProfile.Profile()
+        else:
+            profiler = None
+        profiled = 0
 
         while True:
             data = self.input.get()
             if type(data) is str and data == 'quit':
                 break
-            e = data[0]
+            event, cached = data
+            e = event[0]
+            if monotonic()-self.model_checked>=RELOAD_INTERVAL:
+                self.check_model()
             if DEBUG:
                 # for debug purpose, send back just copies of the initial event
-                self.output.put(np.array([e]*self.odim, dtype=EVENT_TYPE))
+                self.output.put((self.serialize(np.array([tuple(e)]*self.odim, dtype=EVENT_TYPE)),
+                                 dict(self.timing), None, None, False))
                 continue
+            if profiler is not None and profiled<self.profile:
+                profiler.enable()
+                message = self.process_event(e, cached)
+                profiler.disable()
+                profiled += 1
+                if profiled==self.profile:
+                    self.dump_profile(profiler, profiled)
+            else:
+                message = self.process_event(e, cached)
+            self.output.put((message, dict(self.timing), self.hits,
+                             self.map_cache.stats if self.map_cache is not None else None,
+                             self.cache_used))
+
+        if profiler is not None and 0<profiled<self.profile:
+            # connection closed before the requested number of events was reached
+            self.dump_profile(profiler, profiled)
+
+    def setup(self):
+        """
+        Prepare detector size and model, called at the start of the process.
+        Can be used without starting the process to run process_event directly.
+        """
+        self.log.put_nowait((logging.INFO,
+                            f'Start long running computation on process {multiprocessing.current_process()}'))
+        # detector dimension to create at least as many events as requested
+        self.det_dim = int(np.sqrt(self.odim-3)+1)
+        self.log.put_nowait((logging.INFO,
+                            f'  simulation detector size {self.det_dim}x{self.det_dim}'))
+        self.sim_module = import_module(MFILE+self.ba_model)
+        self.load_model()
+        if self.seed is None:
+            self.rng = np.random.default_rng()
+        else:
+            self.rng = np.random.default_rng(np.random.SeedSequence([self.seed, self.stream]))
+            self.log.put_nowait((logging.INFO,
+                                 f'  random stream {self.stream} of run seed {self.seed}'))
+        # oversampled scattering maps of recent incident conditions
+        self.map_cache = MapCache() if self.oversample>1 else None
+        # time spent in each stage for the last processed event
+        self.timing = dict.fromkeys(STAGES, 0.)
+        # detector pixel indices and weights of the scattered events of the last processed event
+        self.hits = None
+        # True if the last processed event was served from a precomputed result
+        self.cache_used = False
+
+    def load_model(self):
+        # set up everything that depends on the model module, called again after a reload
+        self.model_hash = model_hash(self.sim_module)
+        self.model_mtime = os.stat(self.sim_module.__file__).st_mtime
+        self.model_checked = monotonic()
+        self.log.put_nowait((logging.INFO,
+                             f'  loaded model {MFILE+self.ba_model} ({self.model_hash[:12]})'))
+        known = get_parameters(self.sim_module)
+        for key in list(self.params):
+            if key not in known:
+                self.log.put_nowait((logging.WARNING,
+                                     f'  model has no parameter {key}, known are {list(known)}'))
+                del self.params[key]
+        if self.params:
+            self.log.put_nowait((logging.INFO, f'  model parameters {self.params}'))
+        self.symmetry = get_symmetry(self.sim_module)
+        self.sample_phi = None # phi of the last sample created
+        if getattr(self, 'map_cache', None) is not None:
+            # maps of the previous model version
+            self.map_cache.clear()
+        self.engine = None
+        if self.engine_name=='fastborn':
+            self.engine = get_engine(self.sim_module, self.params)
+            if self.engine is None:
+                self.log.put_nowait((logging.WARNING,
+                                     '  model does not support fastborn, using BornAgain'))
+            else:
+                self.log.put_nowait((logging.INFO, '  using pure NumPy fastborn engine'))
+
+    def check_model(self):
+        """
+        Reload the model if the content of its file has changed, keeps the rest
+        of the worker state. Returns True if the model was reloaded.
+        """
+        self.model_checked = monotonic()
+        try:
+            mtime = os.stat(self.sim_module.__file__).st_mtime
+            if mtime==self.model_mtime:
+                return False
+            self.model_mtime = mtime
+            if model_hash(self.sim_module)==self.model_hash:
+                return False
+            self.sim_module = importlib.reload(self.sim_module)
+        except Exception as error:
+            # keep the last working model, e.g. while the file is being edited
+            self.log.put_nowait((logging.ERROR, f'  reload of model {self.ba_model} failed: {error}'))
+            return False
+        self.log.put_nowait((logging.INFO, f'  model file {self.sim_module.__file__} changed, reloading'))
+        self.load_model()
+        return True
+
+    def create_sample(self, phi):
+        # sample for the azimuth phi [deg] with the connection's model parameters
+        return create_sample(self.sim_module, phi, self.params)
+
+    def process_event(self, e, cached=None):
+        """
+        Run the BornAgain simulations for one incident event and return the
+        message with all outgoing events.
+        cached is an optional precomputed (model_hash, pout, alpha_f, phi_f)
+        scattering result for unit intensity, see PrecomputeProcess. It is only
+        used if it belongs to the current model version, which sets cache_used.
+        """
+        t0 = perf_counter()
+        out_events = []
+
+        wavelength, alpha_i, phi_i = incident_conditions(e.vx, e.vy, e.vz)  # Å, deg, deg
+        v = np.sqrt(e.vx ** 2 + e.vy ** 2 + e.vz ** 2)
+        #self.log.put_nowait(f'  incident beam {alpha_i}°, {phi_i}°, {wavelength}')
+
+        # simulate the sample rotated into the fundamental domain of its symmetry
+        phi_model, mirrored = fold_phi(phi_i, *self.symmetry)
+        if self.engine is None and phi_model!=self.sample_phi:
+            self.sample = self.create_sample(phi_model)
+            self.sample_phi = phi_model
+        t1 = perf_counter()
+
+        # Calculated reflected and transmitted (1-reflected) beams
+        reflectivity = self.simulate_specular(wavelength, alpha_i, phi_model)
+        pref = e.p*reflectivity
+        spec = (pref, e.vx, e.vy, -e.vz)
+        ptrans = (1.0-reflectivity)*e.p
+        trans = (ptrans, e.vx, e.vy, e.vz)
+        t2 = perf_counter()
+
+        self.cache_used = cached is not None and cached[0]==self.model_hash
+        if self.cache_used:
+            # calculated in the background for the same conditions within the cache tolerance
+            _, pout, alpha_f, phi_f = cached
+            pout = e.p*pout
+            if mirrored:
+                phi_f = -phi_f
+            t3 = perf_counter()
+        elif self.map_cache is not None:
+            pout, alpha_f, phi_f = self.scatter_oversampled(wavelength, alpha_i, phi_model, mirrored, e.p)
+            t3 = perf_counter()
+            self.map_cache.record(self.map_hit, t3-t2)
+        else:
+            pout, alpha_f, phi_f = self.scatter_event(wavelength, alpha_i, phi_model, mirrored, e.p)
+            t3 = perf_counter()
+
+        if self.roulette>0:
+            # killed events are returned with zero weight and absorbed by the client
+            pout = russian_roulette(pout, self.roulette*e.p, self.rng)
+
+        # calculate beam angle relative to coordinate system, including incident beam direction
+        #alpha_f = ANGLE_RANGE*(np.linspace(1., -1., self.det_dim)+Ry/(self.det_dim-1))
+        phi_f = phi_f-phi_i*deg
+
+        VX, VZ= np.meshgrid(np.sin(phi_f)*v, -np.sin(alpha_f)*v)
+        VY = np.sqrt(v**2 - VX**2 - VZ**2)
+        for pouti, vxi, vyi, vzi in zip(pout.flatten(), VX.flatten(), VY.flatten(), VZ.flatten()):
+            out_events.append((pouti, vxi, vyi, vzi))
+
+        #out = np.array(out_events)
+        if len(out_events)>(self.odim-2):
+            # if number of events requested is too small, throw away random events
+            # and scale the kept ones to conserve the expected intensity
+            self.rng.shuffle(out_events)
+            scale = len(out_events)/(self.odim-2)
+            out_events = [(pi*scale, vxi, vyi, vzi) for pi, vxi, vyi, vzi in out_events[:self.odim-2]]
+        out = np.array([spec, trans]+out_events, dtype=EVENT_TYPE)
+        if self.detector is not None:
+            self.hits = self.detector.hits(out['p'][2:], out['vx'][2:], out['vy'][2:], out['vz'][2:])
+        if self.tally:
+            out = out[:2]
+        t4 = perf_counter()
+
+        self.log.put_nowait((logging.DEBUG, f'  sending back {len(out)} processed events'))
+        message = self.serialize(out)
+        t5 = perf_counter()
+
+        self.timing['sample'] = t1-t0
+        self.timing['specular'] = t2-t1
+        self.timing['scattering'] = t3-t2
+        self.timing['assemble'] = t4-t3
+        self.timing['serialize'] = t5-t4
+        return message
+
+    def scatter_event(self, wavelength, alpha_i, phi_model, mirrored=False, p=1.0):
+        # scattering with a random sub-pixel offset of the detector grid
+        # calculate BINS² outgoing beams with a random angle within one pixel range (-1,-1) to (1,1)
+        Ry =  2*self.rng.random()-1
+        Rz =  2*self.rng.random()-1
+
+        if mirrored:
+            # mirrored sample with mirrored detector offset, directions are flipped back
+            pout, alpha_f, phi_f = self.simulate_scattering(wavelength, alpha_i, phi_model, p, Ry, -Rz)
+            return pout, alpha_f, -phi_f
+        return self.simulate_scattering(wavelength, alpha_i, phi_model, p, Ry, Rz)
+
+    def scatter_oversampled(self, wavelength, alpha_i, phi_model, mirrored=False, p=1.0):
+        """
+        Scattering with a random sub-pixel offset taken from the oversampled map of the
+        incident conditions. The map is calculated for the first event of each condition
+        grid cell and shared with all following events of that cell.
+        """
+        key = self.map_cache.key(wavelength, alpha_i, phi_model)
+        smap = self.map_cache.get(key)
+        self.map_hit = smap is not None
+        if smap is None:
+            smap = self.simulate_map(wavelength, alpha_i, phi_model)
+            self.map_cache.put(key, smap)
+        pmap, alpha_fine, phi_fine = smap
+
+        # continuous shift of the detector grid within (-1/2, 1/2) pixel in units of the map pixels
+        K = self.oversample
+        pad = map_padding(K)
+        n = self.det_dim*K
+        shift_a = (2*self.rng.random()-1)*K/2.
+        shift_p = (2*self.rng.random()-1)*K/2.
+        pout = p*sample_map(pmap, K, self.det_dim, shift_a, shift_p)
+        alpha_f = (alpha_fine[pad:pad+n].reshape(self.det_dim, K).mean(axis=1)
+                   +shift_a*np.diff(alpha_fine).mean())
+        phi_f = (phi_fine[pad:pad+n].reshape(self.det_dim, K).mean(axis=1)
+                 +shift_p*np.diff(phi_fine).mean())
+        if mirrored:
+            phi_f = -phi_f
+        return pout, alpha_f, phi_f
+
+    def simulate_map(self, wavelength, alpha_i, phi_i=0.):
+        """
+        Scattering of unit intensity on a detector grid oversampled by self.oversample
+        and extended on each side to cover all sub-pixel offsets (see BAcache.sample_map).
+        Returns the map with the pixel center angles alpha_f and phi_f (radians).
+        """
+        pad = map_padding(self.oversample)
+        n = self.det_dim*self.oversample+2*pad
+        width = 2.*self.ang_range*deg/(self.det_dim*self.oversample)
+        amax = self.ang_range*deg+pad*width
+        if self.engine is not None:
+            alpha_f = bin_centers(-amax, amax, n)
+            phi_f = bin_centers(-amax, amax, n)
+            return self.engine.scattering(wavelength, alpha_i, alpha_f, phi_f, width, width, phi_i)[0], \
+                   alpha_f, phi_f
+
+        beam = ba.Beam(1.0, wavelength*angstrom, alpha_i*deg)
+        detector = ba.SphericalDetector(n, -amax, amax, n, -amax, amax)
+        sim = ba.ScatteringSimulation(beam, self.sample, detector)
+        sim.options().setUseAvgMaterials(True)
+        sim.options().setNumberOfThreads(1)
+        res = sim.simulate()
+        # copied, the array is a view into res
+        pmap = Arrayf64Converter.asNpArray(res.dataArray()).copy()
+        xs = res.xAxis()
+        ys = res.yAxis()
+        alpha_f = np.array([ys.binCenter(i) for i in range(ys.size())])
+        phi_f = np.array([xs.binCenter(i) for i in range(xs.size())])
+        return pmap, alpha_f, phi_f
+
+    def simulate_specular(self, wavelength, alpha_i, phi_i=0.):
+        """
+        Return the specular reflectivity for the incident beam.
+        """
+        if self.engine is not None:
+            return float(self.engine.specular(wavelength, alpha_i))
+        ssim = self.get_simulation_specular(wavelength, alpha_i)
+        res = ssim.simulate()
+        return Arrayf64Converter.asNpArray(res.dataArray())[0]
 
-            out_events = []
-
-            alpha_i = np.arctan2(e.vz, e.vy) * 180. / np.pi  # deg
-            phi_i = np.arctan2(e.vx, e.vy) * 180. / np.pi  # deg
-            v = np.sqrt(e.vx ** 2 + e.vy ** 2 + e.vz ** 2)
-            wavelength = V2L / v  # Å
-            #self.log.put_nowait(f'  incident beam {alpha_i}°, {phi_i}°, {wavelength}')
-
-            try:
-                self.sample = sim_module.get_sample(phi_i)
-            except TypeError:
-                # assume model is defined without phi_i dependence
-                self.sample = sim_module.get_sample()
-
-            # Calculated reflected and transmitted (1-reflected) beams
-            ssim = self.get_simulation_specular(wavelength, alpha_i)
-            res = ssim.simulate()
-            pref = e.p*Arrayf64Converter.asNpArray(res.dataArray())[0]
-            spec = (pref, e.vx, e.vy, -e.vz)
-            ptrans = (1.0-Arrayf64Converter.asNpArray(res.dataArray())[0])*e.p
-            trans = (ptrans, e.vx, e.vy, e.vz)
-
-            # calculate BINS² outgoing beams with a random angle within one pixel range (-1,-1) to (1,1)
-            Ry =  2*np.random.random()-1
-            Rz =  2*np.random.random()-1
-
-            sim = self.get_simulation(wavelength, alpha_i, e.p, Ry, Rz)
-            sim.options().setUseAvgMaterials(True)
-            # only use one thread, multithreading through McStas making multiple socket connections
-            sim.options().setNumberOfThreads(1)
-            res = sim.simulate()
-            # get probability (intensity) for all pixels
-            pout = Arrayf64Converter.asNpArray(res.dataArray())
-            # calculate beam angle relative to coordinate system, including incident beam direction
-            #alpha_f = ANGLE_RANGE*(np.linspace(1., -1., self.det_dim)+Ry/(self.det_dim-1))
-            xs = res.xAxis()
-            ys = res.yAxis()
-            alpha_f = np.array([ys.binCenter(i) for i in range(ys.size())])
-            phi_f = np.array([xs.binCenter(i) for i in range(ys.size())])-phi_i*deg
-
-            VX, VZ= np.meshgrid(np.sin(phi_f)*v, -np.sin(alpha_f)*v)
-            VY = np.sqrt(v**2 - VX**2 - VZ**2)
-            for pouti, vxi, vyi, vzi in zip(pout.flatten(), VX.flatten(), VY.flatten(), VZ.flatten()):
-                out_events.append((pouti, vxi, vyi, vzi))
-
-            #out = np.array(out_events)
-            if len(out_events)<(self.odim-2):
-                # if number of events requested is too small, throw away random event
-                np.random.shuffle(out_events)
-                out_events = out_events[:self.odim-1]
-            out = np.array([spec, trans]+out_events, dtype=EVENT_TYPE)
-            self.log.put_nowait((logging.DEBUG, f'  sending back {len(out)} processed events'))
-            # convert numpy EVENT_TYPE events back to string
-            mstrs = []
-            for event in out:
-                mstrs.append("%16.9e;%16.9e;%16.9e;%16.9e\n" % tuple(event))
-            message = "".join(mstrs)
-            self.output.put(message)
+    def simulate_scattering(self, wavelength, alpha_i, phi_i=0., p=1.0, Ry=0., Rz=0.):
+        """
+        Return the intensity of all detector pixels together with the
+        pixel center angles alpha_f and phi_f (radians) relative to the beam.
+        """
+        if self.engine is not None:
+            dRy = Ry*self.ang_range*deg/(self.det_dim)
+            dRz = Rz*self.ang_range*deg/(self.det_dim)
+            alpha_f = bin_centers(-self.ang_range*deg+dRy, self.ang_range*deg+dRy, self.det_dim)
+            phi_f = bin_centers(-self.ang_range*deg+dRz, self.ang_range*deg+dRz, self.det_dim)
+            width = 2.*self.ang_range*deg/self.det_dim
+            pout = p*self.engine.scattering(wavelength, alpha_i, alpha_f, phi_f, width, width, phi_i)[0]
+            return pout, alpha_f, phi_f
+
+        sim = self.get_simulation(wavelength, alpha_i, p, Ry, Rz)
+        sim.options().setUseAvgMaterials(True)
+        # only use one thread, multithreading through McStas making multiple socket connections
+        sim.options().setNumberOfThreads(1)
+        res = sim.simulate()
+        # get probability (intensity) for all pixels, copied as the array is a view into res
+        pout = Arrayf64Converter.asNpArray(res.dataArray()).copy()
+        xs = res.xAxis()
+        ys = res.yAxis()
+        alpha_f = np.array([ys.binCenter(i) for i in range(ys.size())])
+        phi_f = np.array([xs.binCenter(i) for i in range(ys.size())])
+        return pout, alpha_f, phi_f
+
+    def dump_profile(self, profiler, events):
+        # write profile tagged with model and connection, can be analyzed with pstats or snakeviz
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        fname = os.path.join(PROFILE_DIR, f'{self.ba_model}_{self.name}.prof')
+        profiler.dump_stats(fname)
+        self.log.put_nowait((logging.INFO, f'  profile of {events} events written to {fname}'))
+
+    @staticmethod
+    def serialize(out):
+        # convert numpy EVENT_TYPE events back to string
+        mstrs = []
+        for event in out:
+            mstrs.append("%16.9e;%16.9e;%16.9e;%16.9e\n" % tuple(event))
+        return "".join(mstrs)
 
     def get_simulation(self, wavelength=6.0, alpha_i=0.2, p=1.0, Ry=0., Rz=0.):
         """
@@ -143,6 +437,30 @@ class BARunnerProcess(multiprocessing.Process):
         scan.setWavelength(wavelength*angstrom)
         return ba.SpecularSimulation(scan, self.sample)
 
+class PrecomputeProcess(BARunnerProcess):
+    """
+    Low priority worker that calculates the scattering of incident conditions
+    expected in a run before the events arrive. Receives (key, wavelength, alpha_i, phi)
+    tasks and returns (key, (model_hash, pout, alpha_f, phi_f)) for unit intensity.
+    """
+
+    def run(self):
+        # only use cpu time that is not needed by the connection workers
+        os.nice(PRECOMPUTE_NICE)
+        self.setup()
+        while True:
+            data = self.input.get()
+            if type(data) is str and data == 'quit':
+                break
+            if monotonic()-self.model_checked>=RELOAD_INTERVAL:
+                self.check_model()
+            key, wavelength, alpha_i, phi = data
+            if self.engine is None and phi!=self.sample_phi:
+                self.sample = self.create_sample(phi)
+                self.sample_phi = phi
+            pout, alpha_f, phi_f = self.scatter_event(wavelength, alpha_i, phi)
+            self.output.put((key, (self.model_hash, pout, alpha_f, phi_f)))
+
 
 async def handle_logging(proc):
     while proc.is_alive():
@@ -151,6 +469,15 @@ async def handle_logging(proc):
         severity, message = proc.log.get()
         logging.log(severity, message)
 
+# global server metrics, served by the optional metrics endpoint
+metrics = Metrics(STAGES)
+# CpuPlacement of the workers, None if not configured on the command line
+placement = None
+# directory to record handshake and incident events of every connection, None to disable
+record_dir = None
+# processes, tolerance and reuse of the background precompute, None to disable
+precompute_options = None
+
 EVENT_TYPE = np.dtype([
     ('p', np.float64),
     ('vx', np.float64),
@@ -169,21 +496,207 @@ async def read_full_request(client):
         request += next
     return request
 
-async def handle_client(client):
+# running number to tag connections in logs and output files
+connection_ids = itertools.count(1)
+# detector statistics by run name, accumulated over all connections of a run
+runs = {}
+
+def open_run(name, options):
+    # start new statistics if no other connection (e.g. MPI process) of the same run is active
+    if name not in runs or runs[name].active==0:
+        runs[name] = RunStatistics.from_options(options)
+    runs[name].active += 1
+    # McStas ncount of the client process, summed over all processes of the run
+    runs[name].ncount += int(float(options.get('ncount', 0)))
+    return runs[name]
+
+def close_run(name, tally=False):
+    # the tally is written once, when the last connection of the run has closed
+    run = runs[name]
+    run.active -= 1
+    if tally and run.active==0:
+        path = os.path.join(TALLY_DIR, name)
+        if run.ncount>0:
+            ncount = run.ncount
+        else:
+            logging.warning(f'Client of run {name} did not send its ncount, '
+                            f'using the number of incident events for Ncount')
+            ncount = run.events
+        run.detector.write(path, ncount=ncount)
+        logging.info(f'Detector tally {name} written to {path}')
+
+# background precompute of each model configuration, shared by all its connections
+precompute_groups = {}
+
+class PrecomputeGroup:
+    """
+    Condition cache and precompute processes of one model configuration.
+    With a worker placement the precompute processes only run on cores without
+    a connection worker and new tasks are held back while all cores are in use.
+    """
+
+    def __init__(self, name, odim, ang_range, ba_model, engine, params):
+        self.name = name
+        self.cache = ConditionCache(precompute_options['tolerance'], precompute_options['reuse'])
+        self.symmetry = get_symmetry(import_module(MFILE+ba_model))
+        self.active = 0
+        self.procs = [PrecomputeProcess(odim, ang_range, ba_model, engine=engine, params=params,
+                                        name=f'precompute{i}')
+                      for i in range(precompute_options['processes'])]
+        self.queued = [0]*len(self.procs)
+        self.cpus = None # cores the precompute processes are currently allowed to use
+
+    def lookup(self, e):
+        """
+        Learn the incident conditions of event e and return a precomputed result or None.
+        """
+        wavelength, alpha_i, phi_i = incident_conditions(e.vx, e.vy, e.vz)
+        key = self.cache.key(wavelength, alpha_i, fold_phi(phi_i, *self.symmetry)[0])
+        self.cache.observe(key)
+        return self.cache.get(key)
+
+    def place(self):
+        """
+        Restrict the precompute processes to the cores not used by connection workers.
+        Returns False if there is no such core.
+        """
+        if placement is None:
+            return True
+        cpus = placement.free_cpus()
+        if cpus and cpus!=self.cpus:
+            for proc in self.procs:
+                try:
+                    os.sched_setaffinity(proc.pid, cpus)
+                except ProcessLookupError:
+                    pass
+            logging.debug(f"Precompute {self.name} placed on cpus {format_cpu_list(cpus)}")
+            self.cpus = cpus
+        return bool(cpus)
+
+    async def run(self):
+        # keep the precompute processes busy with the densest conditions while connections are open
+        for proc in self.procs:
+            proc.start()
+            asyncio.get_event_loop().create_task(handle_logging(proc))
+        while self.active>0:
+            free = self.place()
+            for i, proc in enumerate(self.procs):
+                while not proc.output.empty():
+                    key, result = proc.output.get()
+                    self.cache.put(key, result)
+                    self.queued[i] -= 1
+                while free and self.queued[i]<PRECOMPUTE_QUEUE:
+                    key = self.cache.next_task()
+                    if key is None:
+                        break
+                    proc.input.put((key,)+self.cache.center(key))
+                    self.queued[i] += 1
+            await asyncio.sleep(0.01)
+        for proc in self.procs:
+            proc.input.put('quit')
+        for proc in self.procs:
+            proc.join()
+        logging.info(f"Precompute {self.name} finished, {self.cache.hits} hits, "
+                     f"{self.cache.misses} misses, {self.cache.saved:.1f}s saved")
+
+def open_precompute(odim, ang_range, ba_model, engine, params):
+    # join the precompute group of the model configuration, start it for the first connection
+    name = f"{ba_model}_{odim}_{ang_range:g}_{engine}"+''.join(f"_{k}={v}" for k, v in sorted(params.items()))
+    if name not in precompute_groups or precompute_groups[name].active==0:
+        group = PrecomputeGroup(name, odim, ang_range, ba_model, engine, params)
+        group.active = 1
+        precompute_groups[name] = group
+        logging.info(f"Starting {len(group.procs)} precompute processes for {name}")
+        asyncio.get_event_loop().create_task(group.run())
+    else:
+        group = precompute_groups[name]
+        group.active += 1
+    return group
+
+def status_line(stop):
+    # fixed length line appended to every reply of a run with stop=1, STOP asks the client to end the run
+    return ('STOP' if stop else 'RUN').ljust(EVENT_LENGTH-1)+'\n'
+
+async def handle_status(client, request):
+    """
+    Answer a status query 'STATUS;run{;target{;xmin,xmax,ymin,ymax}}' with one line.
+    """
+    loop = asyncio.get_event_loop()
+    _, name, *query = request.strip().split(';')
+    if name not in runs:
+        reply = f"{name};unknown\n"
+    else:
+        target = float(query[0]) if len(query)>0 and query[0] else None
+        roi = [float(ri) for ri in query[1].split(',')] if len(query)>1 and query[1] else None
+        reply = f"{name};{runs[name].status(target, roi)}\n"
+    await loop.sock_sendall(client, reply.encode('ascii'))
+    client.close()
+
+async def handle_client(client, defaults=None):
     logging.info(f"Connection by client {client}")
     loop = asyncio.get_event_loop()
 
     # handshake with client and extract some simulation parameters
     request = await read_full_request(client)
     if request.startswith('INIT;McStas'):
-        _, _, odim, ang_range, ba_model, *__ = request.split(';')
-        odim = int(odim)
-        ang_range = float(ang_range)
+        odim, ang_range, ba_model, options = parse_handshake(request, defaults)
+        try:
+            oversample = parse_oversample(options.get('oversample', 0))
+        except ValueError as error:
+            logging.warning(f"Rejecting handshake {request.strip()}: {error}")
+            client.close()
+            return
+        conn_id = next(connection_ids)
         logging.info(f"From client '{request.strip()}', sending ACK")
         await loop.sock_sendall(client, b'ACK\n')
-        worker = BARunnerProcess(odim, ang_range, ba_model.strip())
+        if record_dir is not None:
+            # raw requests of the connection that can be replayed with BAloadclient.py --replay
+            os.makedirs(record_dir, exist_ok=True)
+            record = open(os.path.join(record_dir, f'conn{conn_id}.txt'), 'w')
+            record.write(request)
+        else:
+            record = None
+        has_detector = bool(options.get('detector', ''))
+        # scattered events are only dropped from the reply if they go to a server side tally
+        tally = bool(options.get('tally', '')) and has_detector
+        if options.get('tally', '') and not has_detector:
+            logging.warning(f"Connection conn{conn_id} asked for tally={options['tally']} without "
+                            "detector geometry, scattered events are returned to the client")
+        run_name = options.get('tally', '') or options.get('run', '') or ba_model
+        # clients that asked for stop=1 expect a status line after the events of each reply
+        stop = options.get('stop', '0') not in ('0', '') and has_detector
+        if has_detector:
+            # scattered events are projected onto a server side detector, see BAdetector.py
+            detector = DetectorGrid.from_options(options)
+            run = open_run(run_name, options)
+        else:
+            detector = None
+            run = None
+        if placement is not None:
+            node, cpu = placement.assign()
+            logging.info(f"Placing worker conn{conn_id} on NUMA node {node}, cpu {cpu}")
+        else:
+            cpu = None
+        worker = BARunnerProcess(odim, ang_range, ba_model,
+                                 profile=int(options.get('profile', 0)),
+                                 engine=options.get('engine', 'bornagain'),
+                                 roulette=float(options.get('roulette', 0.)),
+                                 detector=detector, tally=tally, cpu=cpu,
+                                 seed=int(options['seed']) if options.get('seed', '') else None,
+                                 stream=int(options.get('stream', 0)), params=model_params(options),
+                                 oversample=oversample, name=f'conn{conn_id}')
         worker.start()
         loop.create_task(handle_logging(worker))
+        conn_metrics = metrics.open_connection(ba_model, worker)
+        if precompute_options is not None and not options.get('seed', '') \
+                and options.get('precompute', '1') not in ('0', ''):
+            # precomputed results depend on timing, seeded runs are always calculated live
+            precompute = open_precompute(odim, ang_range, ba_model, worker.engine_name, worker.params)
+        else:
+            precompute = None
+    elif request.startswith('STATUS'):
+        await handle_status(client, request)
+        return
     else:
         logging.warning(f"Could not establish handshake, client send {request}")
         client.close()
@@ -195,45 +708,135 @@ async def handle_client(client):
         request = await read_full_request(client)
         if request == '':
             break
+        if record is not None:
+            record.write(request)
         event = np.array([tuple(request.split(';'))], dtype=EVENT_TYPE).view(np.rec.recarray)
-        worker.input.put(event)
+        cached = precompute.lookup(event[0]) if precompute is not None else None
+        worker.input.put((event, cached))
         recieved_events += 1
         logging.debug(f'  received event {event}')
         while worker.output.empty():
             await asyncio.sleep(0.001)
-        message = worker.output.get()
+        message, timing, hits, map_stats, cache_used = worker.output.get()
+        if map_stats is not None:
+            metrics.caches[f'oversample_conn{conn_id}'] = map_stats
+        if precompute is not None:
+            # stale results of a previous model version are calculated live and count as miss
+            precompute.cache.record(cache_used, timing['scattering'])
+            metrics.caches[precompute.name] = precompute.cache.stats
+        returned = message.count('\n')
+        if run is not None:
+            run.add(*hits)
+            was_converged = run.converged
+            converged = run.check()
+            if stop:
+                message += status_line(converged and run.stop)
+            if run.converged and not was_converged:
+                logging.info(f'Run {run_name} converged after {run.events} events, '
+                             f'relative error {run.error:.4g}')
         await loop.sock_sendall(client, message.encode('ascii'))
+        metrics.add_event(conn_metrics, returned, timing)
 
-        logging.debug(f'  all events send, waiting for next input...')
+        logging.debug('  all events send, waiting for next input...')
 
     worker.input.put('quit')
     worker.join()
+    if cpu is not None:
+        placement.release(cpu)
+    if record is not None:
+        record.close()
+    if precompute is not None:
+        precompute.active -= 1
+    if run is not None:
+        close_run(run_name, tally)
+    metrics.close_connection(conn_metrics)
+    metrics.caches.pop(f'oversample_conn{conn_id}', None)
     logging.info(f'Received {recieved_events} events')
     client.close()
 
-async def run_server(interface='127.0.0.1', port=15555):
+async def accept_clients(server, defaults=None):
+    loop = asyncio.get_event_loop()
+
+    while True:
+        client, _ = await loop.sock_accept(server)
+        loop.create_task(handle_client(client, defaults))
+
+async def run_server(interface='127.0.0.1', port=15555, metrics_port=None, defaults=None,
+                     unix_path=None):
     logging.info(f"Starting socket server on {interface}:{port}")
+    if metrics_port:
+        asyncio.get_event_loop().create_task(serve_metrics(metrics, port=metrics_port))
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.bind((interface, port))
     server.listen(50)
     server.setblocking(False)
+    servers = [server]
 
-    loop = asyncio.get_event_loop()
+    if unix_path:
+        # local transport for clients on the same machine, avoids the TCP loopback stack
+        logging.info(f"Starting unix domain socket server on {unix_path}")
+        if os.path.lexists(unix_path):
+            # only replace a stale socket of an earlier server, never a regular file
+            if not stat.S_ISSOCK(os.lstat(unix_path).st_mode):
+                raise FileExistsError(f"{unix_path} exists and is not a socket")
+            os.remove(unix_path)
+        userver = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        userver.bind(unix_path)
+        userver.listen(50)
+        userver.setblocking(False)
+        servers.append(userver)
 
-    while True:
-        client, _ = await loop.sock_accept(server)
-        loop.create_task(handle_client(client))
+    await asyncio.gather(*(accept_clients(si, defaults) for si in servers))
 
 
 def main():
-    import sys
-    if len(sys.argv)>1:
-        interface = sys.argv[1]
-    else:
-        interface = '127.0.0.1'
-    asyncio.run(run_server(interface=interface))
+    global placement, record_dir, precompute_options
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('interface', nargs='?', default='127.0.0.1',
+                        help='network interface to listen on')
+    parser.add_argument('--unix', default=None, metavar='PATH',
+                        help='additionally listen on a unix domain socket, BAclient address="unix:PATH"')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve live metrics in Prometheus format on this local port')
+    parser.add_argument('--profile', type=int, default=0, metavar='N',
+                        help=f'profile the first N events of each worker, written to {PROFILE_DIR}/')
+    parser.add_argument('--engine', choices=['bornagain', 'fastborn'], default='bornagain',
+                        help='use the pure NumPy engine for models that declare FAST_BORN parameters')
+    parser.add_argument('--roulette', type=float, default=0., metavar='FRACTION',
+                        help='russian roulette for scattered events below FRACTION of the incident weight')
+    parser.add_argument('--cpus', type=parse_cpu_list, default=None, metavar='LIST',
+                        help='pin workers to these cores, e.g. "0-15,32-47" (default all available)')
+    parser.add_argument('--exclude-cpus', type=parse_cpu_list, default=None, metavar='LIST',
+                        help='never place workers on these cores, e.g. the ones used by McStas')
+    parser.add_argument('--numa', action='store_true',
+                        help='distribute workers round-robin over the NUMA nodes')
+    parser.add_argument('--record', default=None, metavar='DIR',
+                        help='record handshake and incident events of every connection in DIR/conn<N>.txt')
+    parser.add_argument('--oversample', type=parse_oversample, default=0, metavar='K',
+                        help='draw sub-pixel offsets from scattering maps oversampled K>=4 times')
+    parser.add_argument('--precompute', type=int, default=0, metavar='N',
+                        help='N low priority processes per model precompute the most frequent incident conditions')
+    parser.add_argument('--precompute-tolerance', type=float, nargs=3, default=[0.01, 0.002, 0.002],
+                        metavar=('DLAMBDA', 'DALPHA', 'DPHI'),
+                        help='grid of conditions served by one precomputed result [Å, deg, deg]')
+    parser.add_argument('--precompute-reuse', type=int, default=4, metavar='R',
+                        help='number of events served by one precomputed result')
+    args = parser.parse_args()
+    record_dir = args.record
+    if args.precompute>0:
+        precompute_options = {'processes': args.precompute, 'tolerance': args.precompute_tolerance,
+                              'reuse': args.precompute_reuse}
+    if args.cpus or args.exclude_cpus or args.numa:
+        placement = CpuPlacement(args.cpus, args.exclude_cpus, args.numa)
+        logging.info(f"Worker placement {placement.describe()}")
+    # server wide defaults of options that clients can overwrite in the handshake
+    defaults = {'profile': args.profile, 'engine': args.engine, 'roulette': args.roulette,
+                'oversample': args.oversample}
+    asyncio.run(run_server(interface=args.interface, metrics_port=args.metrics_port,
+                           defaults=defaults, unix_path=args.unix))
 
 
 if __name__=='__main__':
     logging.basicConfig(level=logging.INFO)
-    main()
\ No newline at end of file
+    main()
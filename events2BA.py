@@ -7,8 +7,16 @@ from importlib import import_module
 import sys
 from numpy import *
 
-import bornagain as ba
-from bornagain import deg, angstrom, nm
+try:
+    import bornagain as ba
+    from bornagain import deg, angstrom, nm
+except ImportError:
+    # only the fastborn engine (--fastborn) can be used without BornAgain
+    ba = None
+
+import fastborn
+from roulette import russian_roulette
+from models import create_sample, get_symmetry, fold_phi
 
 EFILE = "GISANS_events/test_events.dat" # event file to be used
 OFILE = "test_events_scattered.dat" # event file to be written
@@ -55,6 +63,10 @@ def get_simulation_specular(sample, wavelength=6.0, alpha_i=0.2):
     return ba.SpecularSimulation(scan, sample)
 
 
+symmetry = (1, False) # in-plane symmetry of the model, see models/__init__.py
+ROULETTE = 0. # fraction of incident weight below which scattered events are pruned (0 = off)
+rng = random.default_rng() # random generator for sub-pixel offsets and roulette, seeded by --seed=N
+
 def run_events(events):
     misses = 0
     total = len(events)
@@ -73,8 +85,9 @@ def run_events(events):
             out_events.append(neutron)
             misses += 1
         else:
-            # beam has hit the sample
-            sample = get_sample(phi_i)
+            # beam has hit the sample, simulated in the fundamental domain of the sample symmetry
+            phi_model, mirrored = fold_phi(phi_i, *symmetry)
+            sample = create_sample(sim_module, phi_model)
 
             # Calculated reflected and transmitted (1-reflected) beams
             ssim = get_simulation_specular(sample, wavelength, alpha_i)
@@ -86,47 +99,133 @@ def run_events(events):
                 out_events.append([ptrans, x, y, z, vx, vy, vz, t, sx, sy, sz])
 
             # calculate BINS² outgoing beams with a random angle within one pixel range
-            Ry =  2*random.random()-1
-            Rz =  2*random.random()-1
-            sim = get_simulation(sample, wavelength, alpha_i, p, Ry, Rz)
+            Ry =  2*rng.random()-1
+            Rz =  2*rng.random()-1
+            sim = get_simulation(sample, wavelength, alpha_i, p, Ry, -Rz if mirrored else Rz)
             sim.options().setUseAvgMaterials(True)
             res = sim.simulate()
             # get probability (intensity) for all pixels
             pout = res.array()
+            if mirrored:
+                pout = pout[:, ::-1]
+            if ROULETTE>0:
+                pout = russian_roulette(pout, ROULETTE*p, rng)
             # calculate beam angle relative to coordinate system, including incident beam direction
             alpha_f = ANGLE_RANGE*(linspace(1., -1., BINS)+Ry/(BINS-1))
             phi_f = phi_i+ANGLE_RANGE*(linspace(-1., 1., BINS)+Rz/(BINS-1))
             VX, VZ= meshgrid(tan(phi_f*pi/180.)*vy, tan(alpha_f*pi/180.)*vy)
             for pouti, vxi, vzi in zip(pout.flatten(), VX.flatten(), VZ.flatten()):
+                if ROULETTE>0 and pouti==0.:
+                    continue
                 out_events.append([pouti, x, y, z, vxi, vy, vzi, t, sx, sy, sz])
     print("misses:", misses)
     return array(out_events)
 
-def write_events(out_events):
+def run_events_fast(events, engine):
+    """
+    Same as run_events but all events that hit the sample are calculated at once
+    using the pure NumPy engine from fastborn.py.
+    """
+    hit = (abs(events[:, 1])<=xwidth)&(abs(events[:, 3])<=yheight)
+    print("misses:", (~hit).sum())
+    hits = events[hit]
+    p, x, y, z, vx, vy, vz, t, sx, sy, sz = hits.T
+    alpha_i = arctan(vz/vy)*180./pi  # deg
+    phi_i = arctan(vx/vy)*180./pi  # deg
+    v = sqrt(vx**2+vy**2+vz**2)
+    wavelength = V2L/v  # Å
+
+    # Calculated reflected and transmitted (1-reflected) beams
+    R = engine.specular(wavelength, alpha_i)
+    spec = hits.copy()
+    spec[:, 0] = p*R
+    spec[:, 6] = -vz
+    trans = hits.copy()
+    trans[:, 0] = (1.0-R)*p
+    trans = trans[trans[:, 0]>1e-10]
+
+    # calculate BINS² outgoing beams with a random angle within one pixel range
+    Ry = 2*rng.random(len(hits))-1
+    Rz = 2*rng.random(len(hits))-1
+    alpha_f = ANGLE_RANGE*(linspace(1., -1., BINS)[newaxis, :]+Ry[:, newaxis]/(BINS-1))
+    phi_f = ANGLE_RANGE*(linspace(-1., 1., BINS)[newaxis, :]+Rz[:, newaxis]/(BINS-1))
+    width = 2*ANGLE_RANGE/BINS*pi/180.
+    pout = engine.scattering(wavelength, alpha_i, alpha_f*pi/180., phi_f*pi/180.,
+                             width, width, phi_i)*p[:, newaxis, newaxis]
+    VX = tan((phi_i[:, newaxis, newaxis]+phi_f[:, newaxis, :])*pi/180.)*vy[:, newaxis, newaxis]
+    VZ = tan(alpha_f[:, :, newaxis]*pi/180.)*vy[:, newaxis, newaxis]
+    scattered = repeat(hits, BINS*BINS, axis=0)
+    scattered[:, 0] = pout.flatten()
+    scattered[:, 4] = broadcast_to(VX, pout.shape).flatten()
+    scattered[:, 6] = broadcast_to(VZ, pout.shape).flatten()
+    if ROULETTE>0:
+        scattered[:, 0] = russian_roulette(scattered[:, 0], ROULETTE*repeat(p, BINS*BINS), rng)
+        scattered = scattered[scattered[:, 0]>0.]
+    return vstack([events[~hit], spec, trans, scattered])
+
+def write_events(out_events, ofile=OFILE, efile=EFILE):
+    # write events with the header of the McStas event file they were created from
     header = ''
-    with open(EFILE, 'r') as fh:
+    with open(efile, 'r') as fh:
         line = fh.readline()
         while line.startswith('#'):
             header += line
             line = fh.readline()
-    with open(OFILE, 'w') as fh:
+    with open(ofile, 'w') as fh:
         fh.write(header)
         savetxt(fh, out_events)
 
-def main():
-    print(f'Reading events from {EFILE}...')
-    events = loadtxt(EFILE)
+def load_model(model_file=MFILE):
+    """
+    Import the sample model used by run_events, returns the fastborn engine
+    of the model or None if it does not support it.
+    """
+    global sim_module, symmetry
+    sim_module=import_module(model_file)
+    symmetry=get_symmetry(sim_module)
+    return fastborn.get_engine(sim_module)
+
+def convert_file(efile=EFILE, ofile=OFILE, engine=None):
+    """
+    Read McStas events from efile, calculate the scattering of the model loaded
+    with load_model (with the fastborn engine if given) and write the outgoing
+    events to ofile. Returns the number of incoming and outgoing events.
+    """
+    print(f'Reading events from {efile}...')
+    events = loadtxt(efile, ndmin=2)
     events = prop0(events)
+    if engine is not None:
+        print('Running NumPy Born approximation for all events...')
+        out_events = run_events_fast(events, engine)
+    elif ba is None:
+        raise ImportError("BornAgain is not installed, use the fastborn engine of the model")
+    else:
+        print('Running BornAgain simulations for each event...')
+        out_events = run_events(events)
+    print(f'Writing events to {ofile}...')
+    write_events(out_events, ofile, efile)
+    return len(events), len(out_events)
 
-    if len(sys.argv)>1:
-        MFILE='models.'+sys.argv[1]
-    print(f'Running BornAgain simulations "{MFILE}" for each event...')
-    global get_sample
-    sim_module=import_module(MFILE)
-    get_sample=sim_module.get_sample
-    out_events = run_events(events)
-    print(f'Writing events to {OFILE}...')
-    write_events(out_events)
+def main():
+    args = [ai for ai in sys.argv[1:] if not ai.startswith('--')]
+    if len(args)>0:
+        model_file='models.'+args[0]
+    else:
+        model_file=MFILE
+    global ROULETTE, rng
+    efile, ofile = EFILE, OFILE
+    for ai in sys.argv[1:]:
+        if ai.startswith('--roulette='):
+            ROULETTE = float(ai.split('=', 1)[1])
+        if ai.startswith('--seed='):
+            rng = random.default_rng(int(ai.split('=', 1)[1]))
+        if ai.startswith('--efile='):
+            efile = ai.split('=', 1)[1]
+        if ai.startswith('--ofile='):
+            ofile = ai.split('=', 1)[1]
+    engine = load_model(model_file)
+    print(f'Using model "{model_file}"')
+    convert_file(efile, ofile, engine if '--fastborn' in sys.argv else None)
 
 if __name__=='__main__':
     main()
@@ -0,0 +1,259 @@
+"""
+Pure NumPy distorted wave Born approximation for simple particle-lattice models.
+
+Models that consist of spheres on a finite 2D lattice above a flat substrate
+can declare their parameters in a FAST_BORN dictionary. For these models the
+specular reflectivity and the off-specular scattering of a whole batch of
+incident events is calculated with closed form expressions instead of one
+BornAgain simulation per event.
+
+The particle layer is divided into slices of averaged material, as BornAgain
+does with setUseAvgMaterials. Each slice contributes the sphere segment inside
+it with the four DWBA terms of the (refracted) wave amplitudes in that slice.
+
+Approximations compared to BornAgain:
+
+* The particles have to lie within the particle layer, parts outside of it are ignored.
+* The sphere segments are integrated numerically with Z_SAMPLES points per slice.
+* Only scattering above the sample horizon (alpha_f>0) is calculated.
+
+Use fastborn_check.py to compare the results with BornAgain for the bundled models.
+"""
+
+import numpy as np
+
+ANGSTROM = 0.1 # nm, length unit used for wavelength and SLDs in the models
+DEG = np.pi/180.
+XI_SAMPLES = 90 # number of lattice orientations used for integration over xi
+BATCH_SIZE = 32 # number of events calculated in one array expression
+Z_SAMPLES = 16 # Gauss-Legendre points per slice for the sphere segment form factors
+
+
+def get_engine(sim_module, params=None):
+    """
+    Return the fast engine for a model module or None if the model does not
+    declare a FAST_BORN parameter dictionary.
+    Models with parameters (see models/__init__.py) provide a get_fast_born(**params)
+    function instead, without it the engine is only available for the default parameters.
+    """
+    if params:
+        if not hasattr(sim_module, 'get_fast_born'):
+            return None
+        return SphereLattice(**sim_module.get_fast_born(**params))
+    parameters = getattr(sim_module, 'FAST_BORN', None)
+    if parameters is None:
+        return None
+    return SphereLattice(**parameters)
+
+def bin_centers(vmin, vmax, n):
+    # centers of n equally spaced bins, same as the axis of a BornAgain SphericalDetector
+    return vmin+(np.arange(n)+0.5)*(vmax-vmin)/n
+
+def disc_factor(x):
+    """
+    Normalized form factor 2 J1(x)/x of a disc for x>=0, using the rational
+    approximations of J1 from Numerical Recipes (relative error below 1e-7).
+    """
+    x = np.asarray(x, dtype=float)
+    small = x<8.
+    y = x*x
+    num = 72362614232.0+y*(-7895059235.0+y*(242396853.1+y*(-2972611.439
+                                                            +y*(15704.48260+y*(-30.16036606)))))
+    den = 144725228442.0+y*(2300535178.0+y*(18583304.74+y*(99447.43394+y*(376.9991397+y))))
+    near = 2.*num/den
+    xl = np.where(small, 8., x)
+    z = 8./xl
+    y = z*z
+    xx = xl-2.356194491
+    p1 = 1.0+y*(0.183105e-2+y*(-0.3516396496e-4+y*(0.2457520174e-5+y*(-0.240337019e-6))))
+    p2 = 0.04687499995+y*(-0.2002690873e-3+y*(0.8449199096e-5+y*(-0.88228987e-6+y*0.105787412e-6)))
+    far = 2.*np.sqrt(0.636619772/xl)*(np.cos(xx)*p1-z*np.sin(xx)*p2)/xl
+    return np.where(small, near, far)
+
+def laue2(x, N):
+    # squared Laue function (sin(N x)/sin(x))² with the limit N² at sin(x)=0
+    sx = np.sin(x)
+    small = np.abs(sx)<1e-10
+    return np.where(small, float(N*N), np.sin(N*x)**2/np.where(small, 1., sx)**2)
+
+class SphereLattice:
+    """
+    Homogeneous spheres on a finite 2D lattice in a layer on top of a substrate.
+
+    radius: [nm] sphere radius
+    position: [nm] z-position of the sphere bottom relative to the top of the particle layer
+    sld_*: [Å^-2] scattering length densities of particle, ambient, substrate (can be complex)
+    lattice: (a [nm], b [nm], gamma [deg], xi [deg]) as for BornAgain BasicLattice2D
+    lattice_size: (N1, N2) number of lattice sites of the finite lattice
+    surface_density: [nm^-2] particle surface density
+    layer_thickness: [nm] thickness of the particle layer
+    slices: number of slices of averaged material used for the Fresnel coefficients
+    integrate_xi: average the structure factor over all lattice orientations
+    use_avg_specular: include the averaged particle layer in the specular reflectivity
+    """
+
+    def __init__(self, radius, position, sld_particle, sld_ambient, sld_substrate,
+                 lattice, lattice_size, surface_density, layer_thickness, slices=1,
+                 integrate_xi=True, use_avg_specular=False, xi_samples=XI_SAMPLES):
+        self.radius = radius
+        self.z_center = position+radius
+        self.sld_particle = sld_particle/ANGSTROM**2
+        self.sld_ambient = sld_ambient/ANGSTROM**2
+        self.sld_substrate = sld_substrate/ANGSTROM**2
+        self.lattice = lattice
+        self.lattice_size = lattice_size
+        self.surface_density = surface_density
+        self.layer_thickness = layer_thickness
+        self.slices = slices
+        self.integrate_xi = integrate_xi
+        self.use_avg_specular = use_avg_specular
+        self.xi_samples = xi_samples
+
+        # sliced particle layer with averaged material, from top to bottom
+        d = layer_thickness/slices
+        self.slice_top = -np.arange(slices)*d
+        fraction = surface_density*np.array([self.segment_volume(top-d, top) for top in self.slice_top])/d
+        self.avg_layers = [(self.sld_ambient+fi*(self.sld_particle-self.sld_ambient), d)
+                           for fi in fraction]
+        self.bare_layers = [(self.sld_ambient, layer_thickness)]
+
+        # integration points of the sphere segment in each slice, z relative to the slice top
+        x, w = np.polynomial.legendre.leggauss(Z_SAMPLES)
+        self.segments = []
+        for top in self.slice_top:
+            low, high = max(top-d, self.z_center-radius), min(top, self.z_center+radius)
+            if high<=low:
+                self.segments.append(None)
+                continue
+            z = (low+high)/2.+(high-low)/2.*x
+            rho2 = np.maximum(radius**2-(z-self.z_center)**2, 0.)
+            self.segments.append((z-top, np.sqrt(rho2), (high-low)/2.*w*np.pi*rho2))
+
+    def segment_volume(self, z1, z2):
+        # volume of the sphere between the heights z1<z2
+        low = min(max(z1, self.z_center-self.radius), self.z_center+self.radius)-self.z_center
+        high = min(max(z2, self.z_center-self.radius), self.z_center+self.radius)-self.z_center
+        return np.pi*((self.radius**2*high-high**3/3.)-(self.radius**2*low-low**3/3.))
+
+    def reflection(self, kz, averaged=True):
+        """
+        Reflection amplitude of the layer stack at the top of the particle layer
+        calculated with the Parratt recursion for the given ambient kz [nm^-1].
+        """
+        kz = np.asarray(kz, dtype=complex)
+        layers = (self.avg_layers if averaged else self.bare_layers)+[(self.sld_substrate, 0.)]
+        kzs = [kz]+[np.sqrt(kz**2-4.*np.pi*(sld-self.sld_ambient)) for sld, _ in layers]
+        X = np.zeros_like(kz)
+        for j in reversed(range(len(kzs)-1)):
+            r = (kzs[j]-kzs[j+1])/(kzs[j]+kzs[j+1])
+            if j+1<len(layers):
+                # wave travels through layer j+1 (layers index shifted by ambient)
+                phase = np.exp(2j*kzs[j+1]*layers[j][1])
+            else:
+                phase = 0.
+            X = (r+X*phase)/(1.+r*X*phase)
+        return X
+
+    def waves(self, kz):
+        """
+        Amplitudes of the down (T) and up (R) travelling waves at the top of each averaged
+        slice and the slice kz [nm^-1] for a unit wave incident with ambient kz.
+        Returns arrays (slices, *kz.shape) of kz, T and R.
+        """
+        kz = np.asarray(kz, dtype=complex)
+        layers = [(self.sld_ambient, 0.)]+self.avg_layers+[(self.sld_substrate, 0.)]
+        kzs = [np.sqrt(kz**2-4.*np.pi*(sld-self.sld_ambient)) for sld, _ in layers]
+        # ratio R/T at the top of each layer, from the substrate upwards
+        X = [np.zeros_like(kz)]
+        for j in reversed(range(len(layers)-1)):
+            r = (kzs[j]-kzs[j+1])/(kzs[j]+kzs[j+1])
+            X.insert(0, (r+X[0])/(1.+r*X[0])*np.exp(2j*kzs[j]*layers[j][1]))
+        # continuity of the wave and its derivative at each interface, from the top downwards
+        T = [np.ones_like(kz)]
+        for j in range(len(layers)-2):
+            down = T[j]*np.exp(1j*kzs[j]*layers[j][1])
+            up = X[j]*T[j]*np.exp(-1j*kzs[j]*layers[j][1])
+            T.append(((kzs[j+1]+kzs[j])*down+(kzs[j+1]-kzs[j])*up)/(2.*kzs[j+1]))
+        T = np.array(T[1:])
+        return np.array(kzs[1:-1]), T, np.array(X[1:-1])*T
+
+    def specular(self, wavelength, alpha_i):
+        """
+        Specular reflectivity for arrays of wavelength [Å] and incident angle [deg].
+        """
+        kz = 2.*np.pi/(np.asarray(wavelength)*ANGSTROM)*np.sin(np.asarray(alpha_i)*DEG)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.abs(self.reflection(kz, averaged=self.use_avg_specular))**2
+
+    def structure_factor(self, qx, qy, phi_i=0.):
+        """
+        Interference function of the finite lattice normalized to the number of particles,
+        averaged over the lattice orientation if integrate_xi is set.
+        """
+        a, b, gamma, xi = self.lattice
+        N1, N2 = self.lattice_size
+        if self.integrate_xi:
+            xi = (np.arange(self.xi_samples)+0.5)*2.*np.pi/self.xi_samples
+        else:
+            xi = np.asarray((xi+phi_i)*DEG)[..., np.newaxis]
+        qx = qx[..., np.newaxis]
+        qy = qy[..., np.newaxis]
+        qa = a*(qx*np.cos(xi)+qy*np.sin(xi))
+        qb = b*(qx*np.cos(xi+gamma*DEG)+qy*np.sin(xi+gamma*DEG))
+        return (laue2(qa/2., N1)*laue2(qb/2., N2)).mean(axis=-1)/(N1*N2)
+
+    def scattering(self, wavelength, alpha_i, alpha_f, phi_f, dalpha, dphi, phi_i=0.):
+        """
+        Scattered intensity per unit beam intensity for a batch of N incident events.
+
+        wavelength: [Å] array (N,)
+        alpha_i, phi_i: [deg] arrays (N,), phi_i rotates the lattice like get_sample(phi_i)
+        alpha_f, phi_f: [rad] pixel center arrays (N, n_alpha) and (N, n_phi)
+        dalpha, dphi: [rad] pixel size used for the solid angle
+
+        Returns an array (N, n_alpha, n_phi) normalized the same way as a BornAgain
+        ScatteringSimulation with beam intensity 1.
+        """
+        wavelength = np.atleast_1d(wavelength)
+        alpha_i = np.atleast_1d(alpha_i)
+        phi_i = np.broadcast_to(phi_i, alpha_i.shape)
+        alpha_f = np.atleast_2d(alpha_f)
+        phi_f = np.atleast_2d(phi_f)
+        out = np.empty((len(wavelength), alpha_f.shape[1], phi_f.shape[1]))
+        for start in range(0, len(wavelength), BATCH_SIZE):
+            sl = slice(start, start+BATCH_SIZE)
+            out[sl] = self._scattering_batch(wavelength[sl], alpha_i[sl], alpha_f[sl], phi_f[sl],
+                                             dalpha, dphi, phi_i[sl])
+        return out
+
+    def _scattering_batch(self, wavelength, alpha_i, alpha_f, phi_f, dalpha, dphi, phi_i):
+        k = (2.*np.pi/(wavelength*ANGSTROM))[:, np.newaxis, np.newaxis]
+        ai = (alpha_i*DEG)[:, np.newaxis, np.newaxis]
+        af = alpha_f[:, :, np.newaxis]
+        pf = phi_f[:, np.newaxis, :]
+
+        qx = k*(np.cos(af)*np.cos(pf)-np.cos(ai))
+        qy = k*np.cos(af)*np.sin(pf)
+        q_par = np.sqrt(qx**2+qy**2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            kzi, Ti, Ri = self.waves(k*np.sin(ai))
+            kzf, Tf, Rf = self.waves(k*np.sin(np.maximum(af, 0.)))
+        F = 0.
+        for j, segment in enumerate(self.segments):
+            if segment is None:
+                continue
+            z, rho, weight = segment
+            # lateral form factor of the discs (N, n_alpha, n_phi, Z_SAMPLES)
+            discs = weight*disc_factor(q_par[..., np.newaxis]*rho)
+            # four DWBA terms of incident/outgoing direct and reflected waves in the slice,
+            # phase factors exp(i qz z) of each term (N, n_alpha, Z_SAMPLES, 4)
+            qz = np.stack([-kzi[j]-kzf[j], kzi[j]-kzf[j], kzf[j]-kzi[j], kzi[j]+kzf[j]], axis=-1)
+            phases = np.exp(1j*qz[..., 0, np.newaxis, :]*z[:, np.newaxis])
+            amplitudes = np.stack([Ti[j]*Tf[j], Ri[j]*Tf[j], Ti[j]*Rf[j], Ri[j]*Rf[j]], axis=-1)
+            F = F+((discs@phases)*amplitudes).sum(axis=-1)
+        F = (self.sld_particle-self.sld_ambient)*F
+        S = self.structure_factor(qx, qy, phi_i[:, np.newaxis, np.newaxis])
+        dsigma = self.surface_density*np.abs(F)**2*S
+        solid_angle = dphi*(np.sin(af+dalpha/2.)-np.sin(af-dalpha/2.))
+        intensity = dsigma*solid_angle/np.sin(ai)
+        return np.where(af>0., intensity, 0.)
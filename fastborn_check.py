@@ -0,0 +1,108 @@
+"""
+Cross-check of the pure NumPy engine in fastborn.py against BornAgain.
+
+For every model that declares FAST_BORN parameters, the specular reflectivity
+and the scattered intensity on the BAserver detector grid are calculated with
+both engines for a set of incident conditions and the deviations are reported.
+Only the pixels above the sample horizon are compared, fastborn does not
+calculate the scattering into the substrate.
+Besides the specular and integrated intensity, a condition only passes if the
+intensity weighted RMS of the relative pixel deviations, taken over the pixels
+above --pixel-threshold of the BornAgain maximum, is within --pixel-tolerance.
+
+The scattering is calculated through the BAserver path, which evaluates the
+fastborn engine for one event at a time (a batch of 1). The reported time per
+event therefore is the speed-up of the server; the batched evaluation of
+events2BA.py --fastborn is not measured here.
+"""
+
+import argparse
+import sys
+from importlib import import_module
+from time import perf_counter
+
+import numpy as np
+
+from BAserver import BARunnerProcess, MFILE
+from BAbenchmark import get_models
+
+# (wavelength [Å], alpha_i [deg], phi_i [deg]) test conditions
+CONDITIONS = [(6.0, 0.3, 0.), (5.7, 0.25, 0.02), (6.3, 0.35, -0.02), (4.0, 0.5, 0.), (10.0, 0.2, 0.)]
+
+
+def pixel_deviation(I_fast, I_ba, threshold=0.01):
+    """
+    Intensity weighted RMS and maximum of the relative pixel deviations over the
+    pixels with a BornAgain intensity above threshold times its maximum.
+    """
+    mask = I_ba>threshold*I_ba.max()
+    if not mask.any():
+        return 0., 0.
+    deviation = I_fast[mask]/I_ba[mask]-1.
+    weight = I_ba[mask]
+    return np.sqrt((weight*deviation**2).sum()/weight.sum()), np.abs(deviation).max()
+
+def compare_model(model, odim=443, ang_range=1.5, threshold=0.01):
+    runners = {}
+    for engine in ['bornagain', 'fastborn']:
+        runner = BARunnerProcess(odim, ang_range, model, engine=engine)
+        runner.setup()
+        runners[engine] = runner
+    results = []
+    for wavelength, alpha_i, phi_i in CONDITIONS:
+        ba_runner = runners['bornagain']
+        ba_runner.sample = ba_runner.create_sample(phi_i)
+        R_ba = ba_runner.simulate_specular(wavelength, alpha_i, phi_i)
+        start = perf_counter()
+        I_ba, alpha_f, _ = ba_runner.simulate_scattering(wavelength, alpha_i, phi_i)
+        t_ba = perf_counter()-start
+        R_fast = runners['fastborn'].simulate_specular(wavelength, alpha_i, phi_i)
+        start = perf_counter()
+        I_fast, _, _ = runners['fastborn'].simulate_scattering(wavelength, alpha_i, phi_i)
+        t_fast = perf_counter()-start
+        above = alpha_f>0
+        I_ba = np.asarray(I_ba)[above]
+        I_fast = np.asarray(I_fast).reshape(len(alpha_f), -1)[above]
+
+        pixel_rms, pixel_max = pixel_deviation(I_fast, I_ba, threshold)
+        results.append({
+            'condition': (wavelength, alpha_i, phi_i),
+            'specular': R_fast/R_ba-1.,
+            'integrated': I_fast.sum()/I_ba.sum()-1.,
+            'pixel_rms': pixel_rms,
+            'pixel_max': pixel_max,
+            'speedup': t_ba/max(t_fast, 1e-9),
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-m', '--model', action='append',
+                        help='model to check, can be given multiple times (default all with FAST_BORN)')
+    parser.add_argument('--odim', type=int, default=443)
+    parser.add_argument('--ang-range', type=float, default=1.5)
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='maximum relative deviation of specular and integrated intensity')
+    parser.add_argument('--pixel-tolerance', type=float, default=0.05,
+                        help='maximum intensity weighted RMS of the relative pixel deviations')
+    parser.add_argument('--pixel-threshold', type=float, default=0.01,
+                        help='pixels below this fraction of the maximum intensity are not compared')
+    args = parser.parse_args()
+
+    models = args.model or [mi for mi in get_models()
+                            if hasattr(import_module(MFILE+mi), 'FAST_BORN')]
+    failed = False
+    for model in models:
+        print(f"{model}:")
+        for res in compare_model(model, args.odim, args.ang_range, args.pixel_threshold):
+            ok = (abs(res['specular'])<=args.tolerance and abs(res['integrated'])<=args.tolerance
+                  and res['pixel_rms']<=args.pixel_tolerance)
+            failed |= not ok
+            print("  λ=%5.2fÅ α_i=%5.2f° φ_i=%6.3f°  "%res['condition']
+                  +f"specular {100*res['specular']:+7.2f}%  integrated {100*res['integrated']:+7.2f}%  "
+                  +f"pixels rms {100*res['pixel_rms']:6.2f}% max {100*res['pixel_max']:7.2f}%  "
+                  +f"server speed-up {res['speedup']:6.1f}x  {'OK' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark of the start-up time of mcstas_reader.py.
+
+Every measurement imports the module in a fresh Python process, like a batch
+analysis script started for each run directory. The headless import is
+compared to importing the same libraries as the former eager module
+(numpy, h5py, IPython.display, matplotlib Figure, FigureCanvasAgg, LogNorm)
+and to the import including the plotting functions of mcstas_plot.py.
+Libraries that are not installed are skipped in all variants.
+
+    python import_benchmark.py --repeat 20
+    python import_benchmark.py --load mcstas/run_dir detector
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+EAGER = ["numpy", "h5py", "IPython.display", "IPython.core.pylabtools",
+         "matplotlib.figure", "matplotlib.backends.backend_agg", "matplotlib.colors"]
+
+MEASURE = """
+import sys, json
+from time import perf_counter
+start = perf_counter()
+for name in %r:
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+for name in %r:
+    __import__(name)
+%s
+end = perf_counter()
+print(json.dumps({'time': end-start, 'modules': len(sys.modules),
+                  'plotting': any(mi.startswith(('matplotlib', 'IPython')) for mi in sys.modules)}))
+"""
+
+def measure(optional, required, extra='', repeat=10):
+    """
+    Median wall time [s], number of loaded modules and if plotting libraries were loaded
+    when importing the modules in a new process. Missing optional modules are skipped.
+    """
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', MEASURE%(optional, required, extra)],
+                                capture_output=True, text=True)
+        if result.returncode!=0:
+            raise SystemExit(f"import of {required} failed: {result.stderr.strip().splitlines()[-1]}")
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(data['time'])
+    times.sort()
+    return times[len(times)//2], data['modules'], data['plotting']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='number of processes per variant')
+    parser.add_argument('--load', nargs=2, metavar=('PATH', 'ITEM'),
+                        help='also time reading ITEM of the McStas simulation PATH')
+    args = parser.parse_args()
+
+    variants = [
+        ('eager libraries', EAGER, [], ''),
+        ('mcstas_reader', [], ['mcstas_reader'], ''),
+        ('with plotting', EAGER[1:], ['mcstas_reader', 'mcstas_plot'], ''),
+        ]
+    if args.load:
+        variants.append(('read '+args.load[1], [], ['mcstas_reader'],
+                         'sys.modules["mcstas_reader"].McSim(%r)[%r]'%tuple(args.load)))
+
+    results = {}
+    for label, optional, required, extra in variants:
+        results[label] = measure(optional, required, extra, args.repeat)
+        duration, count, plotting = results[label]
+        print(f"{label:20s} {1e3*duration:8.1f} ms  {count:5d} modules  plotting loaded: {plotting}")
+    eager = results['eager libraries'][0]
+    headless = results['mcstas_reader'][0]
+    print(f"headless import is {eager/max(headless, 1e-9):.1f}x faster "
+          f"({1e3*(eager-headless):.1f} ms saved per process)")
+
+if __name__=='__main__':
+    main()
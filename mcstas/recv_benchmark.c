@@ -0,0 +1,172 @@
+/*******************************************************************************
+* Benchmark of the BAclient reply handling.
+*
+* A forked process emulates BAserver on a TCP loopback connection and replies
+* to every incident event with splits fixed length event lines. The client
+* reads the reply either line by line as the original BAclient (one recv and
+* sscanf per split) or with one receive of the whole reply into a buffer
+* and strtod parsing (current BAclient). Reports recv calls and time per event.
+*
+* Build and run (Linux):
+*   cc -O2 -o recv_benchmark recv_benchmark.c && ./recv_benchmark 443 20000
+*******************************************************************************/
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <signal.h>
+#include <sys/socket.h>
+#include <sys/wait.h>
+#include <arpa/inet.h>
+
+#define BA_EVENT_LENGTH (4*16+3+1)
+
+static long recv_calls = 0;
+
+static int counted_recv(int fd, char *buffer, int length, int flags)
+{
+    recv_calls++;
+    return recv(fd, buffer, length, flags);
+}
+
+static int recv_all(int client_fd, char *buffer, int length)
+{
+    int received = 0, nread;
+    while (received < length) {
+        nread = counted_recv(client_fd, buffer+received, length-received, MSG_WAITALL);
+        if (nread <= 0) break;
+        received += nread;
+    }
+    return received;
+}
+
+static int parse_event(const char *line, double *values)
+{
+    char *end;
+    int i;
+    for (i=0; i<4; i++) {
+        values[i] = strtod(line, &end);
+        if (end == line) break;
+        line = end+1;
+    }
+    return i;
+}
+
+static void run_server(int listen_fd, int splits)
+{
+    // answer every request line with splits events, like BAserver
+    int fd = accept(listen_fd, NULL, NULL);
+    int length = splits*BA_EVENT_LENGTH, i;
+    char *reply = malloc(length+1);
+    char c;
+    for (i=0; i<splits; i++) {
+        sprintf(reply+i*BA_EVENT_LENGTH, "%16.9e;%16.9e;%16.9e;%16.9e\n",
+                1e-3*i, 1.0+i, 650.0, -3.5);
+    }
+    while (recv(fd, &c, 1, 0) == 1) {
+        if (c == '\n') {
+            if (send(fd, reply, length, 0) != length) break;
+        }
+    }
+    close(fd);
+    free(reply);
+    exit(0);
+}
+
+static double now(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec+1e-9*ts.tv_nsec;
+}
+
+static double run_client(int port, int splits, int events, int block, long *calls)
+{
+    int fd = socket(AF_INET, SOCK_STREAM, 0), i, sub_index, nres;
+    struct sockaddr_in serv_addr;
+    char request[255];
+    char rec_event[BA_EVENT_LENGTH+1];
+    char *rec_buffer = calloc(splits*BA_EVENT_LENGTH+1, 1);
+    double tmp_p, tmp_vx, tmp_vy, tmp_vz, values[4], checksum = 0., start;
+
+    memset(&serv_addr, 0, sizeof(serv_addr));
+    serv_addr.sin_family = AF_INET;
+    serv_addr.sin_port = htons(port);
+    serv_addr.sin_addr.s_addr = inet_addr("127.0.0.1");
+    if (connect(fd, (struct sockaddr*)&serv_addr, sizeof(serv_addr)) < 0) {
+        perror("connect");
+        exit(1);
+    }
+
+    recv_calls = 0;
+    start = now();
+    for (i=0; i<events; i++) {
+        sprintf(request, "%e;%e;%e;%e\n", 1.0, 0.1, 650.0, 3.5);
+        send(fd, request, strlen(request), 0);
+        if (block) {
+            recv_all(fd, rec_buffer, splits*BA_EVENT_LENGTH);
+            for (sub_index=0; sub_index<splits; sub_index++) {
+                nres = parse_event(rec_buffer+sub_index*BA_EVENT_LENGTH, values);
+                checksum += values[0]+nres;
+            }
+        } else {
+            for (sub_index=0; sub_index<splits; sub_index++) {
+                counted_recv(fd, rec_event, BA_EVENT_LENGTH, MSG_WAITALL);
+                rec_event[BA_EVENT_LENGTH] = 0;
+                nres = sscanf(rec_event, "%le;%le;%le;%le", &tmp_p, &tmp_vx, &tmp_vy, &tmp_vz);
+                checksum += tmp_p+nres;
+            }
+        }
+    }
+    *calls = recv_calls;
+    close(fd);
+    free(rec_buffer);
+    if (checksum < 0.) printf("%g\n", checksum); // keep the parsing from being optimized away
+    return (now()-start)/events;
+}
+
+static double benchmark(int splits, int events, int block, long *calls)
+{
+    int listen_fd = socket(AF_INET, SOCK_STREAM, 0), one = 1;
+    struct sockaddr_in addr;
+    socklen_t addr_len = sizeof(addr);
+    pid_t pid;
+    double result;
+
+    setsockopt(listen_fd, SOL_SOCKET, SO_REUSEADDR, &one, sizeof(one));
+    memset(&addr, 0, sizeof(addr));
+    addr.sin_family = AF_INET;
+    addr.sin_port = 0;
+    addr.sin_addr.s_addr = inet_addr("127.0.0.1");
+    bind(listen_fd, (struct sockaddr*)&addr, sizeof(addr));
+    getsockname(listen_fd, (struct sockaddr*)&addr, &addr_len);
+    listen(listen_fd, 1);
+
+    pid = fork();
+    if (pid == 0) run_server(listen_fd, splits);
+    result = run_client(ntohs(addr.sin_port), splits, events, block, calls);
+    waitpid(pid, NULL, 0);
+    close(listen_fd);
+    return result;
+}
+
+int main(int argc, char **argv)
+{
+    int splits = argc>1 ? atoi(argv[1]) : 443;
+    int events = argc>2 ? atoi(argv[2]) : 10000;
+    long calls_line, calls_block;
+    double t_line, t_block;
+
+    signal(SIGPIPE, SIG_IGN);
+    t_line = benchmark(splits, events, 0, &calls_line);
+    t_block = benchmark(splits, events, 1, &calls_block);
+
+    printf("splits=%d, %d incident events\n", splits, events);
+    printf("  per split recv+sscanf: %8.1f recv/event  %9.2f us/event\n",
+           (double)calls_line/events, 1e6*t_line);
+    printf("  block recv+strtod:     %8.1f recv/event  %9.2f us/event\n",
+           (double)calls_block/events, 1e6*t_block);
+    printf("  speedup %.2fx\n", t_line/t_block);
+    return 0;
+}
@@ -0,0 +1,117 @@
+#-*- coding: utf-8 -*-
+'''
+Plotting of the datasets read by mcstas_reader.py.
+
+Imported by the plot methods of the mcstas_reader classes on first use, so
+matplotlib and IPython are only loaded by scripts that actually plot.
+'''
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LogNorm
+
+def _axes(ax):
+  # current pylab axes if none are given
+  if ax is None:
+    import pylab
+    ax=pylab.gca()
+  return ax
+
+def _column_label(data, col):
+  col_names=data.info['title'].split()
+  cols=data.info['variables'].split()
+  try:
+    return col+'-'+col_names[cols.index(col)]
+  except (ValueError, IndexError):
+    return col
+
+def plot_graphs(graphs):
+  '''
+    Create one figure for each (xvar, yvar): [datasets] item of graphs.
+  '''
+  figures={}
+  for xy, datasets in sorted(graphs.items()):
+    cols=min(len(datasets), 3)
+    rows=len(datasets)//3+1
+
+    fig=Figure(figsize=(12, 5*rows), dpi=300, facecolor='#FFFFFF')
+    FigureCanvasAgg(fig)
+
+    for i, data in enumerate(datasets):
+      ax=fig.add_subplot(rows, cols, i+1)
+      data.plot(ax=ax)
+    figures[xy]=fig
+  return figures
+
+def repr_png(data):
+  '''
+    PNG image of a dataset for the ipython console/notebook.
+  '''
+  from IPython.core.pylabtools import print_figure
+  fig=Figure(figsize=(8, 5), dpi=300, facecolor='#FFFFFF')
+  FigureCanvasAgg(fig)
+  ax=fig.add_subplot(111)
+
+  data.plot(ax=ax)
+
+  return print_figure(fig, dpi=72)
+
+def plot_dataset1d(data, log=False, ax=None):
+  ax=_axes(ax)
+
+  limits=list(map(float, data.info['xlimits'].split()))
+  x=np.linspace(limits[0], limits[1], len(data.data))
+
+  ax.errorbar(x, data.data, yerr=data.errors)
+  if log:
+    ax.set_yscale('log')
+  else:
+    ax.set_yscale('linear')
+  ax.set_xlabel(data.info['xlabel'])
+  ax.set_ylabel(data.info['ylabel'])
+  ax.set_title(data.info['component'])
+
+def plot_dataset(data, ax=None, cbar=False, **kwargs):
+  ax=_axes(ax)
+
+  limits=list(map(float, data.info['xylimits'].split()))
+
+  img=ax.imshow(data.data, origin='lower', extent=limits, aspect='auto', **kwargs)
+
+  ax.set_xlabel(data.info['xlabel'])
+  ax.set_ylabel(data.info['ylabel'])
+  ax.set_title(data.info['component'])
+
+  if cbar:
+    ax.figure.colorbar(img, ax=ax, label='Intensity')
+
+def plot_tof(data, xcol='x', ycol='y', log=False, ax=None, bins=50, fltr=None, newcols=None,
+             **kwds):
+  ax=_axes(ax)
+
+  x, y, I=data.project2d(xcol, ycol, bins=bins, fltr=fltr, newcols=newcols)
+
+  if log:
+    ax.pcolormesh(x, y, I, norm=LogNorm(), **kwds)
+  else:
+    ax.pcolormesh(x, y, I, **kwds)
+
+  ax.set_xlabel(_column_label(data, xcol))
+  ax.set_ylabel(_column_label(data, ycol))
+  ax.set_title(data.info['component'])
+
+def plot_tof1d(data, col='x', log=False, ax=None, bins=50, fltr=None, newcols=None,
+               **kwds):
+  ax=_axes(ax)
+
+  x, I=data.project1d(col, bins=bins, fltr=fltr, newcols=newcols)
+
+  if log:
+    ax.semilogy((x[:-1]+x[1:])/2., I, **kwds)
+  else:
+    ax.plot((x[:-1]+x[1:])/2., I, **kwds)
+
+  ax.set_xlabel(_column_label(data, col))
+  ax.set_ylabel('Intensity')
+  ax.set_title(data.info['component'])
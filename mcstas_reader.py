@@ -3,27 +3,18 @@
 Simple support library for reading, analyzing and plotting of McStas results
 from the Estia instrument simulations.
 Meant to be used from IPython Notebook or QtConsole, but can also be run stand alone.
+
+The module itself only depends on numpy, so batch analysis scripts start fast.
+h5py is imported when the first NeXuS file is opened and the plotting functions
+of mcstas_plot.py (matplotlib, IPython) when the first plot is made.
 '''
 
 import os, sys
-from numpy import *
-
-try:
-    import h5py
-except ImportError:
-    print("h5py not found, modern NeXuS format will not be readable.")
-
-try:
-  from IPython import display #@UnusedImport
-  from IPython.core.pylabtools import print_figure
-  from matplotlib.figure import Figure
-  from matplotlib.backends.backend_agg import FigureCanvasAgg
-  from matplotlib.colors import LogNorm
-except ImportError:
-  # IPython and/or matplotlib not available, no interactive functionalities
-  display=None
+import numpy as np
 
 MAX_EVTS_BATCH=50000
+# names available in filter and column expressions of TofData, like the former "from numpy import *"
+EVAL_GLOBALS=dict((name, getattr(np, name)) for name in dir(np) if not name.startswith('_'))
     
 class McSim(object):
   '''
@@ -52,6 +43,10 @@ class McSim(object):
         raise IOError("Can't locate mccode.h5 of mccode.sim file in %s"%path)
 
   def _init_hdf(self, path):
+    try:
+      import h5py
+    except ImportError:
+      raise ImportError("h5py not found, modern NeXuS format is not readable.")
     self.hdf=h5py.File(path, 'r')
     self.data_loader=DataLoaderHDF(self.hdf)
     self.info=self.data_loader.info
@@ -83,21 +78,12 @@ class McSim(object):
         graphs[xy].append(data)
       else:
         graphs[xy]=[data]
-    for xy, datasets in sorted(graphs.items()):
-      cols=min(len(datasets), 3)
-      rows=len(datasets)/3+1
-
-      fig=Figure(figsize=(12, 5*rows), dpi=300, facecolor='#FFFFFF')
-      FigureCanvasAgg(fig)
-
-      for i, data in enumerate(datasets):
-        ax=fig.add_subplot(rows, cols, i+1)
-        data.plot(ax=ax)
-      graphs[xy]=fig
+    from mcstas_plot import plot_graphs
+    graphs=plot_graphs(graphs)
     if monitors is None:
       return graphs
     else:
-      return fig
+      return graphs.get(monitors)
 
   def __getitem__(self, item):
     if item in self._data:
@@ -169,17 +155,17 @@ class DataLoaderOld(object):
     y_col=item_info['yvar']
     if x_col.startswith('Li') and y_col=='p': # Detector_nD     
       cols=item_info['variables'].split() 
-      data=loadtxt(fname, dtype={'names': cols, 'formats': ['f4']*len(cols)})
+      data=np.loadtxt(fname, dtype={'names': cols, 'formats': ['f4']*len(cols)})
       return TofData(data, item_info)
     else:
-      raw=loadtxt(fname)
+      raw=np.loadtxt(fname)
       data=raw[:len(raw)//3]
       return Dataset(data, item_info)
 
   def load_item_1d(self, item):
     item_info=self.info['data'][item]
     fname=os.path.join(self.root, item_info['filename'])
-    raw=loadtxt(fname).T
+    raw=np.loadtxt(fname).T
     data=raw[1]
     errors=raw[2]
     return Dataset1D(data, errors, item_info)
@@ -215,7 +201,7 @@ class DataLoaderHDF(object):
       cols=item_info['variables'].split()
       evds=node['events']
       if len(evds)<=MAX_EVTS_BATCH:
-        data=evds.value.astype(float32).view(
+        data=evds[()].astype(np.float32).view(
             dtype={'names': cols, 'formats': ['f4']*len(cols)}).flatten()
       else:
         ds=[]
@@ -225,18 +211,18 @@ class DataLoaderHDF(object):
           sys.stdout.flush()
           ds.append(evds[i*MAX_EVTS_BATCH:(i+1)*MAX_EVTS_BATCH])
         sys.stdout.write('\r%i/%i\n'%(len(evds), len(evds)))
-        data=vstack(ds).astype(float32).view(
+        data=np.vstack(ds).astype(np.float32).view(
             dtype={'names': cols, 'formats': ['f4']*len(cols)}).flatten()
       return TofData(data, item_info)
     else:
-      data=node['data'].value.T
+      data=node['data'][()].T
       return Dataset(data, item_info)
   
   def load_item_1d(self, item):
     item_info=self.info['data'][item]
     node=self.hdf[item_info['datapath']]
-    data=node['data'].value
-    errors=node['errors'].value
+    data=node['data'][()]
+    errors=node['errors'][()]
     return Dataset1D(data, errors, item_info)
 
 class Dataset1D(object):
@@ -249,33 +235,15 @@ class Dataset1D(object):
     self.info=info
 
   def plot(self, log=False, ax=None):
-    if ax is None:
-      import pylab
-      ax=pylab.gca()
-
-    limits=list(map(float, self.info['xlimits'].split()))
-    x=linspace(limits[0], limits[1], len(self.data))
-
-    ax.errorbar(x, self.data, yerr=self.errors)
-    if log:
-      ax.set_yscale('log')
-    else:
-      ax.set_yscale('linear')
-    ax.set_xlabel(self.info['xlabel'])
-    ax.set_ylabel(self.info['ylabel'])
-    ax.set_title(self.info['component'])
+    from mcstas_plot import plot_dataset1d
+    plot_dataset1d(self, log=log, ax=ax)
 
   def _repr_png_(self):
     '''
       Image representation form ipython console/notebook. 
     '''
-    fig=Figure(figsize=(8, 5), dpi=300, facecolor='#FFFFFF')
-    FigureCanvasAgg(fig)
-    ax=fig.add_subplot(111)
-
-    self.plot(ax=ax)
-
-    return print_figure(fig, dpi=72)
+    from mcstas_plot import repr_png
+    return repr_png(self)
 
 
 class Dataset(object):
@@ -287,32 +255,15 @@ class Dataset(object):
     self.info=info
 
   def plot(self, ax=None, cbar=False, **kwargs):
-    if ax is None:
-      import pylab
-      ax=pylab.gca()
-
-    limits=list(map(float, self.info['xylimits'].split()))
-
-    img=ax.imshow(self.data, origin='lower', extent=limits, aspect='auto', **kwargs)
-
-    ax.set_xlabel(self.info['xlabel'])
-    ax.set_ylabel(self.info['ylabel'])
-    ax.set_title(self.info['component'])
-
-    if cbar:
-      pylab.colorbar(img, label='Intensity')
+    from mcstas_plot import plot_dataset
+    plot_dataset(self, ax=ax, cbar=cbar, **kwargs)
 
   def _repr_png_(self):
     '''
       Image representation form ipython console/notebook. 
     '''
-    fig=Figure(figsize=(8, 5), dpi=300, facecolor='#FFFFFF')
-    FigureCanvasAgg(fig)
-    ax=fig.add_subplot(111)
-
-    self.plot(ax=ax)
-
-    return print_figure(fig, dpi=72)
+    from mcstas_plot import repr_png
+    return repr_png(self)
 
 class TofData(Dataset):
   '''
@@ -333,25 +284,25 @@ class TofData(Dataset):
     columns=dict([(coli, self.data[coli]) for coli in self.data.dtype.names])
     if newcols is not None:
       for name, code in newcols:
-        columns[name]=eval(code, globals(), columns)
+        columns[name]=eval(code, EVAL_GLOBALS, columns)
 
     if norm is None:
       w=self.data['p']
     else:
-      w=eval(norm+'*p', globals(), columns)
+      w=eval(norm+'*p', EVAL_GLOBALS, columns)
 
     if fltr is None:
-      I, x=histogram(columns[col], bins=bins, weights=w)
+      I, x=np.histogram(columns[col], bins=bins, weights=w)
       if errors:
-        N, _ = histogram(columns[col], bins=bins)
-        dI = I/sqrt(maximum(N, 1))
+        N, _ = np.histogram(columns[col], bins=bins)
+        dI = I/np.sqrt(np.maximum(N, 1))
     else:
       if isinstance(fltr, str):
-        fltr=eval(fltr, globals(), columns)
-      I, x=histogram(columns[col][fltr], bins=bins, weights=w[fltr])
+        fltr=eval(fltr, EVAL_GLOBALS, columns)
+      I, x=np.histogram(columns[col][fltr], bins=bins, weights=w[fltr])
       if errors:
-        N, _ = histogram(columns[col][fltr], bins=bins)
-        dI = I/sqrt(maximum(N, 1))
+        N, _ = np.histogram(columns[col][fltr], bins=bins)
+        dI = I/np.sqrt(np.maximum(N, 1))
 
     if errors:
       return x, I, dI
@@ -372,64 +323,25 @@ class TofData(Dataset):
     columns=dict([(coli, self.data[coli]) for coli in self.data.dtype.names])
     if newcols is not None:
       for name, code in newcols:
-        columns[name]=eval(code, globals(), columns)
+        columns[name]=eval(code, EVAL_GLOBALS, columns)
 
     if fltr is None:
-      I, y, x=histogram2d(columns[ycol], columns[xcol],
-                        bins=bins, weights=self.data['p'])
+      I, y, x=np.histogram2d(columns[ycol], columns[xcol],
+                           bins=bins, weights=self.data['p'])
     else:
       if isinstance(fltr, str):
-        fltr=eval(fltr, globals(), columns)
-      I, y, x=histogram2d(columns[ycol][fltr], columns[xcol][fltr],
-                        bins=bins, weights=columns['p'][fltr])
+        fltr=eval(fltr, EVAL_GLOBALS, columns)
+      I, y, x=np.histogram2d(columns[ycol][fltr], columns[xcol][fltr],
+                           bins=bins, weights=columns['p'][fltr])
     return x, y, I
 
   def plot(self, xcol='x', ycol='y', log=False, ax=None, bins=50, fltr=None, newcols=None,
            **kwds):
-    if ax is None:
-      import pylab
-      ax=pylab.gca()
-
-    x, y, I=self.project2d(xcol, ycol, bins=bins, fltr=fltr, newcols=newcols)
-
-    if log:
-      ax.pcolormesh(x, y, I, norm=LogNorm(), **kwds)
-    else:
-      ax.pcolormesh(x, y, I, **kwds)
-
-    col_names=self.info['title'].split()
-    cols=self.info['variables'].split()
-
-    try:
-      ax.set_xlabel(xcol+'-'+col_names[cols.index(xcol)])
-    except ValueError:
-      ax.set_xlabel(xcol)
-    try:
-      ax.set_ylabel(ycol+'-'+col_names[cols.index(ycol)])
-    except ValueError:
-      ax.set_ylabel(ycol)
-    ax.set_title(self.info['component'])
-
+    from mcstas_plot import plot_tof
+    plot_tof(self, xcol=xcol, ycol=ycol, log=log, ax=ax, bins=bins, fltr=fltr, newcols=newcols,
+             **kwds)
 
   def plot1d(self, col='x', log=False, ax=None, bins=50, fltr=None, newcols=None,
              **kwds):
-    if ax is None:
-      import pylab
-      ax=pylab.gca()
-
-    x, I=self.project1d(col, bins=bins, fltr=fltr, newcols=newcols)
-
-    if log:
-      ax.semilogy((x[:-1]+x[1:])/2., I, **kwds)
-    else:
-      ax.plot((x[:-1]+x[1:])/2., I, **kwds)
-    col_names=self.info['title'].split()
-    cols=self.info['variables'].split()
-
-    try:
-      ax.set_xlabel(col+'-'+col_names[cols.index(col)])
-    except ValueError:
-      ax.set_xlabel(col)
-    ax.set_ylabel('Intensity')
-    ax.set_title(self.info['component'])
-
+    from mcstas_plot import plot_tof1d
+    plot_tof1d(self, col=col, log=log, ax=ax, bins=bins, fltr=fltr, newcols=newcols, **kwds)
@@ -0,0 +1,71 @@
+"""
+BornAgain sample models, each module defines a get_sample function.
+A leading phi or phi_i argument of get_sample is the incident azimuth [deg],
+models without it are independent of the azimuth. Use create_sample to call
+get_sample with either signature.
+
+Models can declare the in-plane symmetry of the sample with respect to
+the incident azimuth phi_i passed to get_sample:
+
+PHI_SYMMETRY: n for an n-fold rotation symmetry, 0 for an isotropic sample
+PHI_MIRROR:   True if get_sample(-phi) is the mirror image of get_sample(phi)
+              (mirror plane containing the beam at phi=0)
+
+Simulations can then be performed for phi_i folded into the fundamental domain.
+
+Further keyword arguments of get_sample are model parameters with defaults,
+they can be set by clients with 'param.<name>=<value>' handshake options.
+"""
+
+import hashlib
+import inspect
+
+
+def get_symmetry(sim_module):
+    # (n-fold rotation, mirror) declared by the model, no symmetry by default
+    return getattr(sim_module, 'PHI_SYMMETRY', 1), getattr(sim_module, 'PHI_MIRROR', False)
+
+def model_hash(sim_module):
+    # SHA-256 of the model source file, identifies the model version in reloads and stored results
+    with open(sim_module.__file__, 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+def takes_phi(sim_module):
+    # True if the first argument of get_sample is the incident azimuth
+    parameters = list(inspect.signature(sim_module.get_sample).parameters)
+    return bool(parameters) and parameters[0] in ('phi', 'phi_i')
+
+def get_parameters(sim_module):
+    """
+    Return the model parameters with their defaults as a dictionary,
+    all keyword arguments of get_sample except the azimuth.
+    """
+    signature = inspect.signature(sim_module.get_sample)
+    skip = 1 if takes_phi(sim_module) else 0
+    return dict((name, pi.default) for name, pi in list(signature.parameters.items())[skip:]
+                if pi.default is not inspect.Parameter.empty)
+
+def create_sample(sim_module, phi=0., params=None):
+    """
+    Sample of the model for the incident azimuth phi [deg] with the given model parameters,
+    phi is only passed to models that declare it.
+    """
+    params = dict(params or {})
+    if takes_phi(sim_module):
+        return sim_module.get_sample(phi, **params)
+    return sim_module.get_sample(**params)
+
+def fold_phi(phi, symmetry=1, mirror=False):
+    """
+    Fold the incident azimuth phi [deg] into the fundamental domain of the sample symmetry.
+
+    Returns the folded angle and a flag if the scattering calculated for the
+    folded angle has to be mirrored (phi_f -> -phi_f) to get the result for phi.
+    """
+    if symmetry==0:
+        return 0., False
+    period = 360./symmetry
+    phi_fold = (phi+period/2.)%period-period/2.
+    if mirror and phi_fold<0:
+        return -phi_fold, True
+    return phi_fold, False
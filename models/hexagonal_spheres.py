@@ -10,14 +10,27 @@ from bornagain import deg, angstrom, nm, R3, RotationZ
 CLOSED_PACKED_DENSITY = pi/(3*sqrt(2))
 COLLOID_DENSITY = 0.1 # volume fraction of colloid particles, used to get hexagonal unit cell parameter
 Rsphere = 37*nm
-lattice_a = 2*Rsphere * cbrt(CLOSED_PACKED_DENSITY/COLLOID_DENSITY)
-lattice_bh = sqrt(3)/2. * lattice_a
-lattice_c = 3/2*sqrt(3)*lattice_a
 
-def get_sample(phi=0.):
+def get_lattice(radius=Rsphere, colloid_density=COLLOID_DENSITY):
+    # hexagonal lattice parameter a, row distance and stacking period c for a given volume fraction
+    lattice_a = 2*radius * cbrt(CLOSED_PACKED_DENSITY/colloid_density)
+    return lattice_a, sqrt(3)/2. * lattice_a, 3/2*sqrt(3)*lattice_a
+
+lattice_a, lattice_bh, lattice_c = get_lattice()
+
+# no PHI_SYMMETRY: the ABC stacked basis is a rigid compound whose particles move by
+# different lattice vectors under a 60° rotation or mirror, so its form factor is not
+# symmetric between the Bragg rods and phi_i must not be folded
+
+def get_sample(phi=0., radius=Rsphere/nm, colloid_density=COLLOID_DENSITY):
     """
+    phi: [deg] in-plane rotation of the lattice
+    radius: [nm] sphere radius
+    colloid_density: volume fraction of colloid particles
     """
     phi = phi+0.
+    Rsphere = radius*nm
+    lattice_a, lattice_bh, lattice_c = get_lattice(Rsphere, colloid_density)
     # Define materials
     material_Particle = ba.MaterialBySLD("PS", 1.358e-6, 2e-09)
     material_d2o = ba.MaterialBySLD("D2O", 6.364e-6, 2e-09)
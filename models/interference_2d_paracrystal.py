@@ -1,22 +1,30 @@
+from numpy import pi, sin
 import bornagain as ba
 from bornagain import deg, nm
 
+# lattice orientation is integrated over (setIntegrationOverXi), sample is isotropic
+PHI_SYMMETRY = 0
 
-def get_sample():
+
+def get_sample(radius=5., height=5., lattice_length=20.):
+    """
+    radius, height: [nm] cylinder size
+    lattice_length: [nm] paracrystal lattice constant
+    """
     # Define materials
     material_Particle = ba.RefractiveMaterial("Particle", 0.0006, 2e-08)
     material_Substrate = ba.RefractiveMaterial("Substrate", 6e-06, 2e-08)
     material_Vacuum = ba.RefractiveMaterial("Vacuum", 0.0, 0.0)
 
     # Define form factors
-    ff = ba.Cylinder(5*nm, 5*nm)
+    ff = ba.Cylinder(radius*nm, height*nm)
 
     # Define particles
     particle = ba.Particle(material_Particle, ff)
 
     # Define 2D lattices
     lattice = ba.BasicLattice2D(
-        20*nm, 20*nm, 120*deg, 0*deg)
+        lattice_length*nm, lattice_length*nm, 120*deg, 0*deg)
 
     # Define interference functions
     iff = ba.Interference2DParacrystal(lattice, 0*nm, 20000*nm, 20000*nm)
@@ -29,7 +37,7 @@ def get_sample():
     layout = ba.ParticleLayout()
     layout.addParticle(particle, 1.0)
     layout.setInterference(iff)
-    layout.setTotalParticleSurfaceDensity(0.00288675134595)
+    layout.setTotalParticleSurfaceDensity(1./(lattice_length**2*sin(120*pi/180.)))
 
     # Define layers
     layer_1 = ba.Layer(material_Vacuum)
@@ -1,25 +1,53 @@
 """
 Model for Silica particles on Silicon measured in air.
 """
-import bornagain as ba
-from bornagain import nm, deg
+from numpy import pi, sin
+
+# lattice orientation is integrated over (setIntegrationOverXi), sample is isotropic
+PHI_SYMMETRY = 0
+
+def get_fast_born(radius=60., lattice_a=125.):
+    # closed form description of the same sample for the pure NumPy engine in fastborn.py
+    return dict(
+        radius=radius,              # nm
+        position=-2*radius,         # nm, sphere bottom relative to top of particle layer
+        sld_particle=3.47e-06,      # Å^-2
+        sld_ambient=0.0,
+        sld_substrate=2.07e-06,
+        lattice=(lattice_a, lattice_a, 120., 0.),
+        lattice_size=(5, 5),
+        surface_density=1./(lattice_a**2*sin(120*pi/180.)),
+        layer_thickness=2*radius,
+        slices=5,
+        integrate_xi=True,
+        )
+
+FAST_BORN = get_fast_born()
+
+def get_sample(phi_i=0., radius=60., lattice_a=125.):
+    """
+    radius: [nm] particle radius, the particle layer is one diameter thick
+    lattice_a: [nm] hexagonal lattice constant
+    """
+    # imported here, FAST_BORN can be used by events2BA.py without BornAgain
+    import bornagain as ba
+    from bornagain import nm, deg
 
-def get_sample(phi_i=0.):
     # Define materials
     material_Air = ba.MaterialBySLD("Air", 0.0, 0.0)
     material_SiO2 = ba.MaterialBySLD("SiO2", 3.47e-06, 0.0)
     material_Silicon = ba.MaterialBySLD("Silicon", 2.07e-06, 0.0)
 
     # Define form factors
-    ff = ba.Sphere(60*nm)
+    ff = ba.Sphere(radius*nm)
 
     # Define particles
     particle = ba.Particle(material_SiO2, ff)
-    particle.translate(ba.R3(0., 0., -120*nm))
+    particle.translate(ba.R3(0., 0., -2*radius*nm))
 
     # Define 2D lattices
     lattice = ba.BasicLattice2D(
-        125*nm, 125*nm, 120*deg, 0*deg)
+        lattice_a*nm, lattice_a*nm, 120*deg, 0*deg)
 
     # Define interference functions
     iff = ba.InterferenceFinite2DLattice(lattice, 5, 5)
@@ -29,11 +57,11 @@ def get_sample(phi_i=0.):
     layout = ba.ParticleLayout()
     layout.addParticle(particle, 1.0)
     layout.setInterference(iff)
-    layout.setTotalParticleSurfaceDensity(7.39008344563e-05)
+    layout.setTotalParticleSurfaceDensity(1./(lattice_a**2*sin(120*pi/180.)))
 
     # Define layers
     layer_1 = ba.Layer(material_Air)
-    layer_2 = ba.Layer(material_Air, 120*nm)
+    layer_2 = ba.Layer(material_Air, 2*radius*nm)
     layer_2.setNumberOfSlices(5)
     layer_2.addLayout(layout)
     layer_3 = ba.Layer(material_Silicon)
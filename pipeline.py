@@ -0,0 +1,371 @@
+"""
+Overlapped driver for the file based two-pass workflow.
+
+The incident events are captured in chunks by a first McStas pass up to the
+sample (GISANS_events), each chunk is converted by events2BA.py and propagated
+by a second McStas pass (GISANS_events_back) as soon as it is ready. The three
+stages run concurrently, connected by queues of at most --depth chunks, and
+intermediate event files are removed once the next stage has consumed them.
+
+The McStas commands are templates with the placeholders {ncount}, {seed}, {dir}
+and (second pass) {events}. With --synthetic both McStas passes are replaced by
+Python stand-ins that write random incident events and count the outgoing ones,
+which allows to test the pipeline without McStas:
+
+    python pipeline.py silica_100nm_air --synthetic --fastborn --chunks 6 --ncount 200
+
+When all chunks are done, the monitors of the second passes are merged into
+the directory merged/, weighting each chunk by its ncount, which gives the
+result of a single run with the summed ncount.
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import threading
+from time import time
+
+import numpy as np
+
+from BAdetector import DetectorGrid
+
+V2L = 3956.034012 # m/s·Å
+CAPTURE = "./GISANS_events.out --ncount={ncount} --seed={seed} --dir={dir}"
+CAPTURE_FILE = "test_events.dat" # event file written by the first pass into its directory
+BACK = "./GISANS_events_back.out --ncount={ncount} --seed={seed} --dir={dir} events={events}"
+MERGED = "merged" # directory of the merged monitors in the workdir
+# synthetic detector 2 m behind the sample, the beam (sample y-axis) along the absolute z-axis
+SYNTHETIC_DETECTOR = dict(distance=2., xwidth=0.2, yheight=0.2, nx=50, ny=50,
+                          rotation=[[1., 0., 0.], [0., 0., 1.], [0., 1., 0.]])
+
+
+def synthetic_events(fname, n, seed=0, wavelength=6.0, resolution=0.1, alpha_i=0.3, divergence=0.03):
+    """
+    Write n incident events that hit the sample in the format of the McStas
+    Virtual_output used by events2BA.py (p x y z vx vy vz t sx sy sz).
+    """
+    rng = np.random.default_rng(seed)
+    lam = wavelength*(1.+resolution*(rng.random(n)-0.5))
+    v = V2L/lam
+    alpha = (alpha_i+divergence*(rng.random(n)-0.5))*np.pi/180.
+    phi = divergence*(rng.random(n)-0.5)*np.pi/180.
+    events = np.zeros((n, 11))
+    events[:, 0] = 1e3/n
+    events[:, 1] = 0.008*(rng.random(n)-0.5)
+    events[:, 2] = -0.01
+    events[:, 3] = 0.02+0.04*(rng.random(n)-0.5)
+    events[:, 4] = v*np.sin(phi)
+    events[:, 5] = v*np.cos(alpha)
+    events[:, 6] = v*np.sin(alpha)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, 'w') as fh:
+        fh.write('# Format: p x y z vx vy vz t sx sy sz\n# synthetic events of pipeline.py\n')
+        np.savetxt(fh, events)
+
+def synthetic_back(fname, dirname, ncount):
+    # stand-in for the second McStas pass, projects the outgoing events onto a detector
+    events = np.loadtxt(fname, ndmin=2)
+    detector = DetectorGrid(**SYNTHETIC_DETECTOR)
+    if len(events):
+        detector.add(events[:, 0], events[:, 4], events[:, 5], events[:, 6])
+    detector.write(dirname, ncount=ncount)
+    return len(events)
+
+def read_monitor(fname):
+    """
+    Comment lines in front of each data block and the data blocks of an old style
+    McStas array_1d (one block x I I_err N) or array_2d (blocks I, I_err, N) file.
+    """
+    comments, blocks = [[]], [[]]
+    with open(fname) as fh:
+        for line in fh:
+            if line.startswith('#'):
+                if blocks[-1]:
+                    comments.append([])
+                    blocks.append([])
+                comments[-1].append(line)
+            elif line.strip():
+                blocks[-1].append(np.array(line.split(), dtype=float))
+    return comments, [np.array(block) for block in blocks]
+
+def monitor_arrays(blocks):
+    # I, I_err and N of the blocks read by read_monitor
+    if len(blocks)==1:
+        return blocks[0][:, 1], blocks[0][:, 2], blocks[0][:, 3]
+    return blocks
+
+def write_monitor(fname, comments, blocks, ncount):
+    # write merged blocks with the comments of read_monitor, returns the updated header entries
+    I, I_err, N = monitor_arrays(blocks)
+    info = {
+        'Ncount': f'{ncount}',
+        'signal': f'Min={I.min():g}; Max={I.max():g}; Mean={I.mean():g};',
+        'values': f'{I.sum():g} {np.sqrt((I_err**2).sum()):g} {N.sum():g}',
+        }
+    with open(fname, 'w') as fh:
+        for lines, block in zip(comments, blocks):
+            for line in lines:
+                key = line[1:].split(':', 1)[0].strip()
+                if key in info:
+                    line = f'# {key}: {info[key]}\n'
+                fh.write(line)
+            np.savetxt(fh, block)
+    return info
+
+def merge_monitors(dirnames, ncounts, outdir):
+    """
+    Merge the monitors of McStas runs with the given ncounts into outdir.
+
+    McStas normalizes the intensity of each run to its ncount, the merged intensity
+    is the ncount weighted mean (errors added in quadrature, counts summed), which
+    equals a single run with the total ncount. Returns the merged file names.
+    """
+    total = sum(ncounts)
+    with open(os.path.join(dirnames[0], 'mccode.sim')) as fh:
+        sim = fh.read().split('begin data')
+    files = []
+    os.makedirs(outdir, exist_ok=True)
+    for i, block in enumerate(sim[1:]):
+        info = dict(line.strip().split(':', 1) for line in block.splitlines() if ':' in line)
+        fname = info['filename'].strip()
+        files.append(fname)
+        I = I_err2 = N = 0.
+        for dirname, ncount in zip(dirnames, ncounts):
+            comments, blocks = read_monitor(os.path.join(dirname, fname))
+            Ii, Ii_err, Ni = monitor_arrays(blocks)
+            I = I+ncount/total*Ii
+            I_err2 = I_err2+(ncount/total*Ii_err)**2
+            N = N+Ni
+        if len(blocks)==1:
+            blocks = [np.column_stack([blocks[0][:, 0], I, np.sqrt(I_err2), N])]
+        else:
+            blocks = [I, np.sqrt(I_err2), N]
+        for key, value in write_monitor(os.path.join(outdir, fname), comments, blocks, total).items():
+            if key in info:
+                block = block.replace(f'{key}:{info[key]}', f'{key}: {value}')
+        sim[i+1] = block
+    with open(os.path.join(outdir, 'mccode.sim'), 'w') as fh:
+        for line in 'begin data'.join(sim).splitlines(keepends=True):
+            if line.strip().startswith('Ncount:'):
+                line = line.split('Ncount:')[0]+f'Ncount: {total}\n'
+            fh.write(line)
+    return files
+
+def run_command(template, **values):
+    # run one McStas pass, raising an error if it fails
+    subprocess.run(shlex.split(template.format(**values)), check=True,
+                   stdout=subprocess.DEVNULL)
+
+class BornAgainStage(multiprocessing.Process):
+    """
+    Converts event files with events2BA.py, importing BornAgain and the model only once.
+    Receives (chunk, efile, ofile) and returns (chunk, incoming, outgoing, start, end, error).
+    """
+
+    def __init__(self, model, depth=2, fast=False, roulette=0., seed=None):
+        self.model = model
+        self.fast = fast
+        self.roulette = roulette
+        self.seed = seed
+        self.input = multiprocessing.Queue(depth)
+        self.output = multiprocessing.Queue(depth)
+        super().__init__(name='events2BA')
+
+    def run(self):
+        import events2BA
+        events2BA.ROULETTE = self.roulette
+        if self.seed is not None:
+            events2BA.rng = np.random.default_rng(self.seed)
+        engine = events2BA.load_model('models.'+self.model)
+        if not self.fast:
+            engine = None
+        while True:
+            data = self.input.get()
+            if data is None:
+                break
+            chunk, efile, ofile = data
+            start = time()
+            try:
+                incoming, outgoing = events2BA.convert_file(efile, ofile, engine)
+            except Exception as error:
+                self.output.put((chunk, 0, 0, start, time(), repr(error)))
+                continue
+            self.output.put((chunk, incoming, outgoing, start, time(), None))
+        self.output.put(None)
+
+class Pipeline:
+    """
+    Runs chunks of a two-pass simulation through capture, events2BA and back-propagation.
+    """
+
+    def __init__(self, model, chunks=8, ncount=100000, workdir='pipeline_run', depth=2,
+                 capture=CAPTURE, capture_file=CAPTURE_FILE, back=BACK, synthetic=False,
+                 fast=False, roulette=0., seed=1, keep=False):
+        self.model = model
+        self.chunks = chunks
+        self.ncount = ncount
+        self.workdir = workdir
+        self.capture = capture
+        self.capture_file = capture_file
+        self.back = back
+        self.synthetic = synthetic
+        self.seed = seed
+        self.keep = keep
+        self.stage = BornAgainStage(model, depth, fast, roulette, seed)
+        self.times = {} # (stage, chunk): (start, end) relative to the pipeline start
+        self.errors = []
+        self.outgoing = 0
+        self.done = {} # chunk: capture ncount of the chunks that passed all stages
+
+    def record(self, stage, chunk, start, end=None):
+        self.times[(stage, chunk)] = (start-self.start, (end or time())-self.start)
+
+    def send(self, data):
+        # put into the bounded events2BA queue, gives up if the stage has died
+        while self.stage.is_alive():
+            try:
+                self.stage.input.put(data, timeout=1.)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def receive(self):
+        # next result of the events2BA stage, None when it has finished or died
+        while True:
+            try:
+                return self.stage.output.get(timeout=1.)
+            except queue.Empty:
+                if not self.stage.is_alive():
+                    self.errors.append(f'events2BA stage exited with code {self.stage.exitcode}')
+                    return None
+
+    def capture_chunks(self):
+        # first stage, blocks while depth chunks are waiting for events2BA
+        for chunk in range(self.chunks):
+            start = time()
+            dirname = os.path.join(self.workdir, f'capture_{chunk:04d}')
+            efile = os.path.join(dirname, self.capture_file)
+            try:
+                if self.synthetic:
+                    synthetic_events(efile, self.ncount, seed=self.seed+chunk)
+                else:
+                    run_command(self.capture, ncount=self.ncount, seed=self.seed+chunk, dir=dirname)
+            except (OSError, subprocess.CalledProcessError) as error:
+                self.errors.append(f'capture {chunk}: {error}')
+                continue
+            self.record('capture', chunk, start)
+            if not self.send((chunk, efile, self.scattered_file(chunk))):
+                return
+        self.send(None)
+
+    def scattered_file(self, chunk):
+        return os.path.join(self.workdir, f'scattered_{chunk:04d}.dat')
+
+    def back_propagate(self):
+        # third stage, consumes the converted chunks in the order they are finished
+        while True:
+            data = self.receive()
+            if data is None:
+                break
+            chunk, incoming, outgoing, start, end, error = data
+            if not self.keep:
+                shutil.rmtree(os.path.join(self.workdir, f'capture_{chunk:04d}'), ignore_errors=True)
+            if error is not None:
+                self.errors.append(f'events2BA {chunk}: {error}')
+                continue
+            self.record('events2BA', chunk, start, end)
+            ofile = self.scattered_file(chunk)
+            start = time()
+            dirname = os.path.join(self.workdir, f'back_{chunk:04d}')
+            try:
+                if self.synthetic:
+                    self.outgoing += synthetic_back(ofile, dirname, self.ncount)
+                else:
+                    run_command(self.back, ncount=outgoing, seed=self.seed+chunk, dir=dirname, events=ofile)
+                    self.outgoing += outgoing
+            except (OSError, subprocess.CalledProcessError) as error:
+                self.errors.append(f'back {chunk}: {error}')
+                continue
+            self.record('back', chunk, start)
+            self.done[chunk] = self.ncount
+            if not self.keep:
+                os.remove(ofile)
+
+    def merge(self):
+        # combine the monitors of all finished chunks into a single result
+        if not self.done:
+            return
+        chunks = sorted(self.done)
+        try:
+            merge_monitors([os.path.join(self.workdir, f'back_{chunk:04d}') for chunk in chunks],
+                           [self.done[chunk] for chunk in chunks],
+                           os.path.join(self.workdir, MERGED))
+        except (OSError, KeyError, ValueError) as error:
+            self.errors.append(f'merge: {error}')
+
+    def run(self):
+        """
+        Process all chunks and return the wall time together with the summed time of all stages.
+        """
+        os.makedirs(self.workdir, exist_ok=True)
+        self.start = time()
+        self.stage.start()
+        capture = threading.Thread(target=self.capture_chunks, daemon=True)
+        back = threading.Thread(target=self.back_propagate, daemon=True)
+        capture.start()
+        back.start()
+        capture.join()
+        back.join()
+        self.stage.join()
+        self.merge()
+        wall = time()-self.start
+        busy = sum(end-start for start, end in self.times.values())
+        return wall, busy
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='model name in the models folder')
+    parser.add_argument('--chunks', type=int, default=8, help='number of chunks')
+    parser.add_argument('--ncount', type=int, default=100000, help='McStas ncount of each chunk')
+    parser.add_argument('--depth', type=int, default=2,
+                        help='maximum number of chunks waiting between two stages')
+    parser.add_argument('-d', '--workdir', default='pipeline_run')
+    parser.add_argument('--capture', default=CAPTURE, help='command template of the first McStas pass')
+    parser.add_argument('--capture-file', default=CAPTURE_FILE,
+                        help='event file name written by the first pass into its directory')
+    parser.add_argument('--back', default=BACK, help='command template of the second McStas pass')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='replace both McStas passes by synthetic events and an event counter')
+    parser.add_argument('--fastborn', action='store_true', help='use the NumPy engine of events2BA.py')
+    parser.add_argument('--roulette', type=float, default=0.)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='keep intermediate event files')
+    args = parser.parse_args()
+
+    pipeline = Pipeline(args.model, args.chunks, args.ncount, args.workdir, args.depth,
+                        args.capture, args.capture_file, args.back, args.synthetic,
+                        args.fastborn, args.roulette, args.seed, args.keep)
+    wall, busy = pipeline.run()
+    for stage in ['capture', 'events2BA', 'back']:
+        times = [pipeline.times[key] for key in sorted(pipeline.times) if key[0]==stage]
+        if times:
+            print(f"{stage:10s} {len(times):4d} chunks  {sum(e-s for s, e in times):9.2f}s  "
+                  f"first done {times[0][1]:8.2f}s  last done {max(e for _, e in times):8.2f}s")
+    if pipeline.done:
+        print(f"monitors of {len(pipeline.done)} chunks merged into "
+              f"{os.path.join(args.workdir, MERGED)} (ncount {sum(pipeline.done.values())})")
+    print(f"{pipeline.outgoing} outgoing events, wall time {wall:.2f}s for {busy:.2f}s of stage time "
+          f"(overlap {busy/max(wall, 1e-9):.2f}x)")
+    for error in pipeline.errors:
+        print(f"ERROR {error}")
+    if pipeline.errors:
+        raise SystemExit(1)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+HDF5 store for many reference detector images of BornAgain and McStas simulations.
+
+Every result is kept in its own group /results/<key> with chunked, compressed
+image datasets and the instrument configuration, model, model hash and timing
+as attributes. A small index table /index holds one row per result, so results
+can be looked up by their parameters without reading any image data and
+single images or sub-regions are read on demand:
+
+    with ResultStore('ba_output/reference.h5') as store:
+        for key in store.find(model='silica_100nm_air', source='mcstas'):
+            roi = store.read(key, np.s_[100:156, 120:136])
+
+Requires h5py.
+"""
+
+import json
+from dataclasses import asdict, is_dataclass
+from time import time
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+CHUNKS = (64, 64) # pixels per chunk, regions only read the chunks they touch
+COMPRESSION = dict(compression='gzip', compression_opts=4, shuffle=True)
+# InstrumentConfig fields (BAreference.py) stored as index columns
+CONFIG_FIELDS = ('I0', 'collimation', 'source_size', 'alpha_i', 'wavelength')
+# text columns of the index, stored as variable length strings
+STRING_FIELDS = ('source', 'model', 'model_hash', 'params')
+
+
+def index_type():
+    # row type of the index table, needs h5py for the variable length strings
+    string = h5py.string_dtype()
+    return np.dtype([('key', 'S8')]+[(name, string) for name in STRING_FIELDS]
+                    +[(name, np.float64) for name in CONFIG_FIELDS+('duration', 'created')])
+
+def as_text(value):
+    # index strings are returned as bytes by h5py
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class ResultStore:
+    """
+    Indexed collection of detector images in one HDF5 file, opened with the
+    h5py file mode (default 'a' creates or appends).
+    """
+
+    def __init__(self, path, mode='a'):
+        if h5py is None:
+            raise ImportError("ResultStore requires h5py")
+        self.path = path
+        self.hdf = h5py.File(path, mode)
+        if 'index' not in self.hdf and mode!='r':
+            self.hdf.create_dataset('index', shape=(0,), maxshape=(None,), dtype=index_type(), chunks=(256,))
+            self.hdf.create_group('results')
+
+    def close(self):
+        self.hdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def index(self):
+        # complete index table as numpy structured array
+        if 'index' not in self.hdf:
+            return np.zeros(0, dtype=index_type())
+        return self.hdf['index'][:]
+
+    def keys(self):
+        return [as_text(ki) for ki in self.index['key']]
+
+    def add(self, I, model, config, source='bornagain', model_hash='', params=None,
+            duration=np.nan, errors=None, counts=None, extent=None, extent_unit='cm', **attrs):
+        """
+        Store an image I with the InstrumentConfig (dataclass or dict) used to create it.
+
+        source: 'bornagain', 'mcstas' or another label used to select results
+        model_hash: models.model_hash of the sample model
+        params: model parameters passed to get_sample
+        duration: [s] time needed to calculate the result
+        errors, counts: optional images of the same shape (e.g. McStas I_err and N)
+        extent: (xmin, xmax, ymin, ymax) of the image in extent_unit, for detector images
+                position on the detector relative to the direct beam like the McStas PSD_monitor
+        Further keyword arguments are stored as attributes. Returns the key of the result.
+        """
+        config = asdict(config) if is_dataclass(config) else dict(config)
+        params = dict(params or {})
+        index = self.hdf['index']
+        key = f'{len(index):08d}'
+
+        row = np.zeros(1, dtype=index.dtype)
+        text = {'key': key, 'source': source, 'model': model, 'model_hash': model_hash,
+                'params': json.dumps(params, sort_keys=True)}
+        for name, value in text.items():
+            field = index.dtype[name]
+            if field.kind=='S' and len(value.encode())>field.itemsize:
+                # fixed width column of a file written by an older version
+                raise ValueError(f"{name} '{value}' is longer than the {field.itemsize} bytes "
+                                 f"of the index in {self.path}")
+            row[name] = value
+        for name in CONFIG_FIELDS:
+            row[name] = np.nan if config.get(name) is None else config[name]
+        row['duration'] = duration
+        row['created'] = time()
+
+        group = self.hdf['results'].create_group(key)
+        for name, data in [('I', I), ('I_err', errors), ('N', counts)]:
+            if data is None:
+                continue
+            data = np.asarray(data, dtype=np.float64)
+            chunks = tuple(min(ci, si) for ci, si in zip(CHUNKS, data.shape)) if data.ndim==2 else True
+            group.create_dataset(name, data=data, chunks=chunks, **COMPRESSION)
+        group.attrs['source'] = source
+        group.attrs['model'] = model
+        group.attrs['model_hash'] = model_hash
+        group.attrs['config'] = json.dumps(config)
+        group.attrs['params'] = json.dumps(params)
+        group.attrs['duration'] = duration
+        if extent is not None:
+            group.attrs['extent'] = np.asarray(extent, dtype=np.float64)
+            group.attrs['extent_unit'] = extent_unit
+        for name, value in attrs.items():
+            group.attrs[name] = value
+
+        index.resize((len(index)+1,))
+        index[-1] = row[0]
+        return key
+
+    def add_mcstas(self, path, item, model, config, model_hash='', params=None, **attrs):
+        """
+        Store the 2D monitor item of a McStas simulation (directory, mccode.sim or
+        mccode.h5 as accepted by mcstas_reader.McSim).
+        """
+        from mcstas_reader import McSim
+        data = McSim(path)[item]
+        info = data.info
+        extent = [float(vi) for vi in info['xylimits'].split()] if 'xylimits' in info else None
+        extra = dict((key, info[key]) for key in ('Ncount', 'component', 'title') if key in info)
+        extra.update(attrs)
+        return self.add(np.asarray(data.data), model, config, source='mcstas', model_hash=model_hash,
+                        params=params, extent=extent, mcstas_path=str(path), **extra)
+
+    def find(self, **criteria):
+        """
+        Keys of all results matching the criteria, e.g. find(model='silica_100nm_air',
+        collimation=10.). Floating point columns are compared with np.isclose,
+        params can be given as dictionary.
+        """
+        index = self.index
+        match = np.ones(len(index), dtype=bool)
+        for name, value in criteria.items():
+            if name=='params':
+                value = json.dumps(dict(value), sort_keys=True)
+            column = index[name]
+            if column.dtype.kind in 'SO':
+                match &= np.array([as_text(ci)==str(value) for ci in column], dtype=bool)
+            else:
+                match &= np.isclose(column, value)
+        return [as_text(ki) for ki in index['key'][match]]
+
+    def read(self, key, region=(), dataset='I'):
+        """
+        Read an image or a region of it, given as index tuple like np.s_[10:20, 30:40].
+        Only the chunks that overlap with the region are decompressed.
+        """
+        return self.hdf['results'][key][dataset][region]
+
+    def attrs(self, key):
+        """
+        Metadata of a result with config and params decoded.
+        """
+        attrs = dict(self.hdf['results'][key].attrs)
+        for name in ('config', 'params'):
+            attrs[name] = json.loads(attrs[name])
+        return attrs
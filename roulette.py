@@ -0,0 +1,17 @@
+"""
+Russian roulette for low weight events, shared by BAserver.py and events2BA.py.
+"""
+
+import numpy as np
+
+
+def russian_roulette(p, threshold, rng=np.random):
+    """
+    Unbiased pruning of low weight events. Events with weight below threshold
+    survive with probability p/threshold and get the weight threshold,
+    the others get weight 0.
+    """
+    p = np.asarray(p, dtype=float)
+    low = p<threshold
+    survive = rng.random(p.shape)*threshold<p
+    return np.where(low, np.where(survive, threshold, 0.), p)
@@ -1,7 +1,7 @@
-python BAreference.py silica_100nm_air 5
-python BAreference.py silica_100nm_air 10
-python BAreference.py silica_100nm_air 20
+python BAreference.py silica_100nm_air 5 ba_output/reference.h5
+python BAreference.py silica_100nm_air 10 ba_output/reference.h5
+python BAreference.py silica_100nm_air 20 ba_output/reference.h5
 
-python BAreference.py hexagonal_spheres 5
-python BAreference.py hexagonal_spheres 10
-python BAreference.py hexagonal_spheres 20
+python BAreference.py hexagonal_spheres 5 ba_output/reference.h5
+python BAreference.py hexagonal_spheres 10 ba_output/reference.h5
+python BAreference.py hexagonal_spheres 20 ba_output/reference.h5
@@ -0,0 +1,72 @@
+"""
+Tests of the server side detector in BAdetector.py.
+"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from BAdetector import DetectorGrid, RunStatistics
+from mcstas_reader import McSim
+
+
+def test_pixels_center_and_edges():
+    grid = DetectorGrid(2., 0.4, 0.2, 4, 2)
+    # center, corner pixels and just outside the detector in x and y
+    vx = np.array([0., -0.19, 0.19, 0.19, 0.21, 0.])
+    vy = np.array([0., -0.09, 0.09, -0.09, 0., 0.11])
+    vz = np.full(6, 2.)
+    assert list(grid.pixels(vx, vy, vz))==[6, 0, 7, 3, -1, -1]
+
+def test_pixels_backwards_missed():
+    grid = DetectorGrid(1., 1., 1., 3, 3)
+    assert list(grid.pixels([0., 0.], [0., 0.], [1., -1.]))==[4, -1]
+
+def test_rotation():
+    # sample frame beam along y, the rotation maps it onto the absolute z-axis
+    rotation = [[1., 0., 0.], [0., 0., 1.], [0., 1., 0.]]
+    grid = DetectorGrid(1., 1., 1., 3, 3, rotation)
+    assert list(grid.pixels([0., 0.], [1., 1.], [0., 0.4]))==[4, 7]
+
+def test_from_options():
+    grid = DetectorGrid.from_options({'detector': '10,1,0.5,16,8', 'rotation': '0,1,0,1,0,0,0,0,1'})
+    assert (grid.distance, grid.xwidth, grid.yheight, grid.nx, grid.ny)==(10., 1., 0.5, 16, 8)
+    assert np.array_equal(grid.rotation, [[0., 1., 0.], [1., 0., 0.], [0., 0., 1.]])
+    assert np.array_equal(DetectorGrid.from_options({'detector': '1,1,1,2,2'}).rotation, np.eye(3))
+
+def test_add_hits():
+    grid = DetectorGrid(1., 1., 1., 3, 3)
+    grid.add([1., 2., 3.], [0., 0., 0.], [0., 0., 5.], [1., 1., 1.])
+    idx, p = grid.hits([1., 2., 3.], [0., 0., 0.], [0., 0., 5.], [1., 1., 1.])
+    assert list(idx)==[4, 4] and list(p)==[1., 2.]
+    assert grid.I[4]==3. and grid.I2[4]==5. and grid.N[4]==2
+    assert grid.I.sum()==3. and grid.N.sum()==2
+
+def test_roi_and_relative_error():
+    grid = DetectorGrid(1., 1., 1., 2, 2)
+    assert grid.relative_error()==np.inf
+    grid.add_pixels(np.array([0, 0, 0, 0, 3]), np.array([1., 1., 1., 1., 2.]))
+    assert grid.roi_mask().all()
+    assert list(grid.roi_mask((-0.5, 0., -0.5, 0.)))==[True, False, False, False]
+    assert grid.relative_error((-0.5, 0., -0.5, 0.))==pytest.approx(0.5)
+    assert grid.relative_error()==pytest.approx((2.+2.)/6.)
+
+def test_write(tmp_path):
+    grid = DetectorGrid(10., 1., 0.5, 4, 2)
+    grid.add_pixels(np.array([1, 1, 6]), np.array([0.5, 0.25, 2.]))
+    grid.write(str(tmp_path), ncount=1000)
+    data = McSim(str(tmp_path))['detector']
+    assert data.data.shape==(2, 4)
+    assert data.data[0, 1]==pytest.approx(0.75) and data.data[1, 2]==pytest.approx(2.)
+    assert data.info['Ncount']=='1000'
+    assert list(map(float, data.info['xylimits'].split()))==[-50., 50., -25., 25.]
+
+def test_run_statistics():
+    stats = RunStatistics.from_options({'detector': '1,1,1,2,2', 'target': '0.5',
+                                        'roi': '-0.5,0,-0.5,0', 'stop': '1'})
+    assert stats.stop and stats.roi==[-0.5, 0., -0.5, 0.]
+    stats.add(np.array([0, 0, 0, 0]), np.ones(4))
+    assert stats.events==1
+    assert stats.check()
+    assert 'converged=1' in stats.status()
+    assert 'converged=0' in stats.status(target=0.1)
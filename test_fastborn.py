@@ -0,0 +1,42 @@
+"""
+Tests of the pure NumPy engine in fastborn.py. The comparison with BornAgain
+through fastborn_check.py is skipped if BornAgain is not installed.
+"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import fastborn
+from models import silica_100nm_air
+
+
+def test_disc_factor():
+    assert fastborn.disc_factor(0.)==pytest.approx(1.)
+    # first zero of J1 and the value 2 J1(10)/10 on both sides of the approximation switch
+    assert fastborn.disc_factor(3.831705970) == pytest.approx(0., abs=1e-8)
+    assert fastborn.disc_factor(10.) == pytest.approx(2*0.04347274616886144/10., rel=1e-6)
+
+def test_slices_contain_sphere():
+    engine = fastborn.get_engine(silica_100nm_air)
+    volume = sum(engine.segment_volume(top-engine.layer_thickness/engine.slices, top)
+                 for top in engine.slice_top)
+    assert volume==pytest.approx(4./3.*np.pi*engine.radius**3)
+
+def test_waves_without_layer_contrast():
+    # without particles the slices are ambient, only the substrate reflects
+    engine = fastborn.SphereLattice(**dict(silica_100nm_air.FAST_BORN, surface_density=0.))
+    kz = np.array([0.01, 0.05])
+    kzs, T, R = engine.waves(kz)
+    assert np.allclose(kzs, kz)
+    # down travelling wave exp(-i kz z) at the slice tops z<=0
+    assert np.allclose(T, np.exp(-1j*kz*engine.slice_top[:, np.newaxis]))
+    assert np.allclose(R[0], engine.reflection(kz, averaged=False))
+
+def test_compare_bornagain():
+    pytest.importorskip('bornagain')
+    from fastborn_check import compare_model
+    for result in compare_model('silica_100nm_air'):
+        assert abs(result['specular'])<1e-3
+        assert abs(result['integrated'])<0.01
+        assert result['pixel_rms']<0.01
@@ -0,0 +1,48 @@
+"""
+Tests of the handshake parsing in BAhandshake.py, which runs without BornAgain.
+"""
+
+import pytest
+
+from BAhandshake import parse_handshake, model_params, parse_oversample
+
+
+def test_parse_handshake():
+    odim, ang_range, model, options = parse_handshake("INIT;McStas;443;1.50000;silica_100nm_air\n")
+    assert (odim, ang_range, model, options)==(443, 1.5, 'silica_100nm_air', {})
+
+def test_parse_handshake_options():
+    request = "INIT;McStas;102;0.75; hexagonal_spheres ;seed=3; param.radius = 50 ;detector=10,1,1,8,8;flag\n"
+    odim, ang_range, model, options = parse_handshake(request)
+    assert (odim, ang_range, model)==(102, 0.75, 'hexagonal_spheres')
+    # items without '=' are ignored, only the first '=' splits key and value
+    assert options=={'seed': '3', 'param.radius': '50', 'detector': '10,1,1,8,8'}
+    assert parse_handshake("INIT;McStas;1;1;m;roi=a=b")[3]=={'roi': 'a=b'}
+
+def test_parse_handshake_defaults():
+    defaults = {'engine': 'fastborn', 'roulette': '0.1'}
+    options = parse_handshake("INIT;McStas;443;1.5;m;roulette=0", defaults)[3]
+    assert options=={'engine': 'fastborn', 'roulette': '0'}
+    assert defaults=={'engine': 'fastborn', 'roulette': '0.1'}
+
+def test_parse_handshake_invalid():
+    with pytest.raises(ValueError):
+        parse_handshake("INIT;McStas;443;1.5")
+    with pytest.raises(ValueError):
+        parse_handshake("INIT;McStas;many;1.5;m")
+
+def test_model_params():
+    options = {'param.radius': '50', 'param.lattice_a': '1e2', 'param.material': 'SiO2',
+               'seed': '3', 'parameters': '1'}
+    assert model_params(options)=={'radius': 50., 'lattice_a': 100., 'material': 'SiO2'}
+    assert model_params({})=={}
+
+@pytest.mark.parametrize('text, K', [('0', 0), (0, 0), ('4', 4), ('5', 5), ('8', 8), (' 16 ', 16)])
+def test_parse_oversample(text, K):
+    assert parse_oversample(text)==K
+
+@pytest.mark.parametrize('text', ['1', '2', '3', '-4', '2.5', 'x', ''])
+def test_parse_oversample_invalid(text):
+    # maps coarser than MIN_OVERSAMPLE bias the intensity and are rejected
+    with pytest.raises(ValueError):
+        parse_oversample(text)
@@ -0,0 +1,124 @@
+"""
+Tests of the model parameter and symmetry handling in models/__init__.py and of
+the paths that create samples from models with and without a leading azimuth argument.
+
+The sample creation paths of BAserver.py, events2BA.py and BAreference.py
+require BornAgain and are skipped if it is not installed.
+"""
+
+import functools
+import inspect
+import types
+
+import pytest
+
+import models
+
+PARACRYSTAL = "interference_2d_paracrystal"
+
+
+def fake_model(with_phi):
+    module = types.ModuleType('fake_model')
+    if with_phi:
+        def get_sample(phi=0., radius=5., height=5.):
+            return ('sample', phi, radius, height)
+    else:
+        def get_sample(radius=5., height=5.):
+            return ('sample', None, radius, height)
+    module.get_sample = get_sample
+    return module
+
+@pytest.mark.parametrize('with_phi', [True, False])
+def test_get_parameters(with_phi):
+    assert models.get_parameters(fake_model(with_phi))=={'radius': 5., 'height': 5.}
+
+def test_create_sample_with_phi():
+    assert models.create_sample(fake_model(True), 30., {'height': 7.})==('sample', 30., 5., 7.)
+
+def test_create_sample_without_phi():
+    # phi must not be bound to the first model parameter
+    assert models.create_sample(fake_model(False), 0.)==('sample', None, 5., 5.)
+    assert models.create_sample(fake_model(False), 30., {'height': 7.})==('sample', None, 5., 7.)
+
+@pytest.mark.parametrize('phi, symmetry, expected', [
+    (0., 6, 0.), (29.9, 6, 29.9), (30., 6, -30.), (-30., 6, -30.), (45., 6, -15.),
+    (-45., 6, 15.), (365., 6, 5.), (-725., 6, -5.), (90., 4, 0.), (50., 4, -40.),
+    (170., 1, 170.), (190., 1, -170.),
+    ])
+def test_fold_phi(phi, symmetry, expected):
+    # folded into [-period/2, period/2) around zero
+    assert models.fold_phi(phi, symmetry)==(pytest.approx(expected), False)
+
+@pytest.mark.parametrize('phi, expected', [
+    (0., (0., False)), (20., (20., False)), (-20., (20., True)), (40., (20., True)),
+    (-40., (20., False)), (30., (30., True)), (-390., (30., True)),
+    ])
+def test_fold_phi_mirror(phi, expected):
+    folded, mirrored = models.fold_phi(phi, 6, mirror=True)
+    assert (folded, mirrored)==(pytest.approx(expected[0]), expected[1])
+    assert 0.<=folded<=30.
+
+@pytest.mark.parametrize('phi', [-170., 0., 12.5, 400.])
+def test_fold_phi_isotropic(phi):
+    # symmetry 0 declares an isotropic sample, all azimuths are calculated at 0
+    assert models.fold_phi(phi, 0)==(0., False)
+    assert models.fold_phi(phi, 0, mirror=True)==(0., False)
+
+def test_get_symmetry():
+    module = fake_model(True)
+    assert models.get_symmetry(module)==(1, False)
+    module.PHI_SYMMETRY = 6
+    module.PHI_MIRROR = True
+    assert models.get_symmetry(module)==(6, True)
+    module.PHI_SYMMETRY = 0
+    assert models.get_symmetry(module)==(0, True)
+
+
+class SampleCreated(Exception):
+    pass
+
+@pytest.fixture
+def paracrystal(monkeypatch):
+    """
+    Replace get_sample of the paracrystal model by a wrapper that stops the calling
+    path with the keyword arguments the model received.
+    """
+    pytest.importorskip('bornagain')
+    from models import interference_2d_paracrystal as module
+    original = module.get_sample
+
+    @functools.wraps(original)
+    def get_sample(*args, **kwargs):
+        bound = inspect.signature(original).bind(*args, **kwargs)
+        bound.apply_defaults()
+        raise SampleCreated(dict(bound.arguments))
+
+    monkeypatch.setattr(module, 'get_sample', get_sample)
+    return get_sample
+
+DEFAULTS = {'radius': 5., 'height': 5., 'lattice_length': 20.}
+
+def test_paracrystal_server(paracrystal):
+    from BAserver import BARunnerProcess
+    runner = BARunnerProcess(443, 1.5, PARACRYSTAL)
+    runner.setup()
+    with pytest.raises(SampleCreated) as created:
+        runner.create_sample(0.)
+    assert created.value.args[0]==DEFAULTS
+
+def test_paracrystal_events2BA(paracrystal, tmp_path):
+    import numpy as np
+    import events2BA
+    efile = tmp_path/'events.dat'
+    # one event that hits the sample: p x y z vx vy vz t sx sy sz
+    np.savetxt(efile, [[1., 0., -0.01, 0.02, 0., 1000., 5., 0., 0., 0., 0.]])
+    events2BA.load_model('models.'+PARACRYSTAL)
+    with pytest.raises(SampleCreated) as created:
+        events2BA.convert_file(str(efile), str(tmp_path/'scattered.dat'))
+    assert created.value.args[0]==DEFAULTS
+
+def test_paracrystal_reference(paracrystal):
+    from BAreference import BARunner
+    with pytest.raises(SampleCreated) as created:
+        BARunner(ba_model=PARACRYSTAL).simulate()
+    assert created.value.args[0]==DEFAULTS
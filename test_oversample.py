@@ -0,0 +1,76 @@
+"""
+Tests of the oversampled scattering maps: sampling of a map at a sub-pixel offset
+(BAcache.sample_map) and, with BornAgain, the mean intensity of oversampled
+events compared to events calculated with a random detector offset.
+"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from BAcache import map_padding, sample_map
+
+
+def padded(fine, K):
+    # surround a fine map with the padding expected by sample_map
+    return np.pad(fine, map_padding(K), mode='edge')
+
+@pytest.mark.parametrize('K', [4, 5, 8])
+def test_sample_map_no_shift(K):
+    det_dim = 3
+    fine = np.random.default_rng(1).random((det_dim*K, det_dim*K))
+    pixels = sample_map(padded(fine, K), K, det_dim, 0., 0.)
+    assert np.allclose(pixels, fine.reshape(det_dim, K, det_dim, K).sum(axis=(1, 3)))
+
+def test_sample_map_integer_shift():
+    K, det_dim = 4, 3
+    pmap = np.random.default_rng(2).random((det_dim*K+2*map_padding(K),)*2)
+    pad = map_padding(K)
+    pixels = sample_map(pmap, K, det_dim, 1., -2.)
+    expected = pmap[pad+1:pad+1+det_dim*K, pad-2:pad-2+det_dim*K]
+    assert np.allclose(pixels, expected.reshape(det_dim, K, det_dim, K).sum(axis=(1, 3)))
+
+def test_sample_map_continuous_shift():
+    # bilinear interpolation is exact for a linear map, the pixels follow the offset continuously
+    K, det_dim = 4, 2
+    n = det_dim*K+2*map_padding(K)
+    ja, jp = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    pmap = 1.+0.5*ja+0.25*jp
+    for shift_a, shift_p in [(0.3, -0.7), (-2., 1.999), (1.5, 0.25)]:
+        pixels = sample_map(pmap, K, det_dim, shift_a, shift_p)
+        a = map_padding(K)+shift_a+np.arange(det_dim*K)
+        p = map_padding(K)+shift_p+np.arange(det_dim*K)
+        expected = 1.+0.5*a[:, None]+0.25*p[None, :]
+        assert np.allclose(pixels, expected.reshape(det_dim, K, det_dim, K).sum(axis=(1, 3)))
+
+def test_sample_map_conserves_constant():
+    K, det_dim = 6, 4
+    pmap = np.ones((det_dim*K+2*map_padding(K),)*2)
+    rng = np.random.default_rng(3)
+    for _ in range(10):
+        shift_a, shift_p = (2*rng.random(2)-1)*K/2.
+        assert np.allclose(sample_map(pmap, K, det_dim, shift_a, shift_p), K*K)
+
+
+def scattered_intensity(K, events, model='silica_100nm_air', condition=(6.0, 0.3, 0.)):
+    # total and forward (phi_f=0 column) scattered intensity of events with identical conditions
+    from BAserver import BARunnerProcess
+    runner = BARunnerProcess(443, 1.5, model, seed=1, oversample=K)
+    runner.setup()
+    runner.sample = runner.create_sample(condition[2])
+    scatter = runner.scatter_oversampled if K else runner.scatter_event
+    total, forward = [], []
+    for _ in range(events):
+        pout = np.asarray(scatter(*condition)[0]).reshape(runner.det_dim, runner.det_dim)
+        total.append(pout.sum())
+        forward.append(pout[:, runner.det_dim//2].sum())
+    return np.array(total), np.array(forward)
+
+@pytest.mark.parametrize('K', [4, 8])
+def test_oversampled_mean(K):
+    pytest.importorskip('bornagain')
+    reference = scattered_intensity(0, 400)
+    oversampled = scattered_intensity(K, 400)
+    for ref, over in zip(reference, oversampled):
+        error = np.hypot(ref.std()/np.sqrt(len(ref)), over.std()/np.sqrt(len(over)))
+        assert abs(over.mean()-ref.mean())<=4*error+1e-3*abs(ref.mean())
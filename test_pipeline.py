@@ -0,0 +1,74 @@
+"""
+Tests of the overlapped two-pass driver pipeline.py with the synthetic McStas
+stand-ins and the fastborn engine, which run without McStas and BornAgain.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from BAdetector import DetectorGrid
+from mcstas_reader import McSim
+from pipeline import MERGED, merge_monitors, read_monitor, monitor_arrays
+
+# run the pipeline command line with the import of BornAgain blocked
+NO_BORNAGAIN = "import sys, runpy; sys.modules['bornagain'] = None; sys.argv[0] = 'pipeline.py'; " \
+               "runpy.run_path('pipeline.py', run_name='__main__')"
+
+
+def test_synthetic_fastborn(tmp_path):
+    workdir = tmp_path/'run'
+    result = subprocess.run([sys.executable, '-c', NO_BORNAGAIN, 'silica_100nm_air', '--synthetic',
+                             '--fastborn', '--chunks', '3', '--ncount', '50', '-d', str(workdir)],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode==0, result.stdout+result.stderr
+    assert 'merged' in result.stdout
+    chunks = [monitor_arrays(read_monitor(str(workdir/f'back_{chunk:04d}'/'detector.psd'))[1])
+              for chunk in range(3)]
+    merged = McSim(str(workdir/MERGED))['detector']
+    assert merged.info['Ncount']=='150'
+    assert np.allclose(merged.data, sum(chunk[0] for chunk in chunks)/3., rtol=1e-5)
+
+def test_merge_equals_single_run(tmp_path):
+    # McStas weights are normalized to the ncount of each run
+    rng = np.random.default_rng(4)
+    ncounts = [100, 300, 200]
+    velocities = [rng.normal([0., 0., 1.], 0.05, (ni, 3)).T for ni in ncounts]
+    dirnames = []
+    for chunk, (ncount, v) in enumerate(zip(ncounts, velocities)):
+        grid = DetectorGrid(1., 0.4, 0.4, 12, 10)
+        grid.add(np.full(ncount, 1./ncount), *v)
+        dirnames.append(str(tmp_path/f'back_{chunk}'))
+        grid.write(dirnames[-1], ncount=ncount)
+    single = DetectorGrid(1., 0.4, 0.4, 12, 10)
+    single.add(np.full(sum(ncounts), 1./sum(ncounts)), *np.hstack(velocities))
+
+    assert merge_monitors(dirnames, ncounts, str(tmp_path/'merged'))==['detector.psd']
+    I, I_err, N = monitor_arrays(read_monitor(str(tmp_path/'merged'/'detector.psd'))[1])
+    assert np.allclose(I.flatten(), single.I, rtol=1e-5)
+    assert np.allclose(I_err.flatten(), np.sqrt(single.I2), rtol=1e-5)
+    assert np.array_equal(N.flatten(), single.N)
+    assert McSim(str(tmp_path/'merged'))['detector'].info['Ncount']=='600'
+
+def test_merge_1d(tmp_path):
+    header = "# type: array_1d(3)\n# Ncount: {}\n# values: 0 0 0\n# variables: L I I_err N\n"
+    for chunk, (ncount, I) in enumerate([(10, 1.), (30, 3.)]):
+        path = tmp_path/f'back_{chunk}'
+        path.mkdir()
+        (path/'mccode.sim').write_text("begin data\n  filename: lambda.dat\n  Ncount: 1\n"
+                                       "  values: 0 0 0\nend data\n")
+        with open(path/'lambda.dat', 'w') as fh:
+            fh.write(header.format(ncount))
+            np.savetxt(fh, [[5., I, 0.1*I, 2.], [6., 2*I, 0.2*I, 4.], [7., 0., 0., 0.]])
+    merge_monitors([str(tmp_path/'back_0'), str(tmp_path/'back_1')], [10, 30], str(tmp_path/'merged'))
+    comments, blocks = read_monitor(str(tmp_path/'merged'/'lambda.dat'))
+    assert '# Ncount: 40\n' in comments[0]
+    assert np.allclose(blocks[0][:, 0], [5., 6., 7.])
+    assert np.allclose(blocks[0][:, 1], [2.5, 5., 0.])
+    assert np.allclose(blocks[0][:, 3], [4., 8., 0.])
+    assert 'values: 7.5' in (tmp_path/'merged'/'mccode.sim').read_text()
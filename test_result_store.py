@@ -0,0 +1,34 @@
+"""
+Tests of the HDF5 result store with a McStas style detector image written by BAdetector.
+"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('h5py')
+
+from BAdetector import DetectorGrid
+from result_store import ResultStore
+
+CONFIG = {'I0': 1e5, 'collimation': 10., 'source_size': 0.01, 'alpha_i': 0.3, 'wavelength': 6.}
+
+
+def test_add_mcstas(tmp_path):
+    grid = DetectorGrid(10., 1., 1., 16, 8)
+    grid.add(np.ones(3), np.zeros(3), np.zeros(3), np.ones(3))
+    grid.write(str(tmp_path/'run'), ncount=1000)
+    with ResultStore(str(tmp_path/'store.h5')) as store:
+        key = store.add_mcstas(str(tmp_path/'run'), 'detector', 'silica_100nm_air', CONFIG)
+        assert store.find(source='mcstas', collimation=10.)==[key]
+        assert store.read(key).shape==(8, 16)
+        attrs = store.attrs(key)
+        assert list(attrs['extent'])==[-50., 50., -50., 50.]
+        assert attrs['extent_unit']=='cm'
+
+def test_long_strings(tmp_path):
+    model = 'model_'+'x'*100
+    params = dict((f'parameter_{i}', float(i)) for i in range(30))
+    with ResultStore(str(tmp_path/'store.h5')) as store:
+        key = store.add(np.zeros((4, 4)), model, CONFIG, params=params)
+    with ResultStore(str(tmp_path/'store.h5'), 'r') as store:
+        assert store.find(model=model, params=params)==[key]
@@ -0,0 +1,41 @@
+"""
+Tests of the Russian roulette of low weight events in roulette.py.
+"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from roulette import russian_roulette
+
+
+def test_high_weights_unchanged():
+    p = np.array([0.5, 1., 2.])
+    assert np.array_equal(russian_roulette(p, 0.5, np.random.default_rng(1)), p)
+
+def test_low_weights_threshold_or_zero():
+    p = np.array([[0.01, 0.2], [0.3, 0.05]])
+    out = russian_roulette(p, 0.4, np.random.default_rng(2))
+    assert out.shape==p.shape
+    assert set(np.unique(out))<={0., 0.4}
+
+def test_zero_threshold():
+    p = np.array([0., 1e-9, 3.])
+    assert np.array_equal(russian_roulette(p, 0., np.random.default_rng(3)), p)
+
+def test_unbiased():
+    # the expected weight is conserved, the survival probability is p/threshold
+    p = np.full(200000, 0.01)
+    out = russian_roulette(p, 0.1, np.random.default_rng(4))
+    survived = (out>0).mean()
+    assert survived==pytest.approx(0.1, abs=5*np.sqrt(0.1*0.9/len(p)))
+    assert out.sum()==pytest.approx(p.sum(), rel=0.03)
+
+def test_seeded_reproducible():
+    p = np.random.default_rng(5).random(100)*0.2
+    assert np.array_equal(russian_roulette(p, 0.1, np.random.default_rng(6)),
+                          russian_roulette(p, 0.1, np.random.default_rng(6)))
+
+def test_scalar():
+    assert russian_roulette(2., 1.)==2.
+    assert russian_roulette(0.5, 1., np.random.default_rng(7)) in (0., 1.)